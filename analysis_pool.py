@@ -0,0 +1,227 @@
+"""
+Process-pool executor for CPU-heavy SMC analysis.
+
+The compact bar arrays (see bars.py) are copied once into a
+multiprocessing.shared_memory block and only a small descriptor (block name,
+row count, price dtype, timezone) is sent to the worker, instead of pickling
+them through the pool pipe.
+
+Workers are started with forkserver (spawn where it is unavailable), never
+by forking the app process: by the time the pool starts the app already runs
+upstream scheduler threads and, under ASGI, the event loop's thread pool.
+The fork server preloads the analysis stack once, so starting a worker
+stays cheap.
+
+Environment:
+    ANALYSIS_POOL_SIZE    worker processes per app process (default: CPUs per app process,
+                          0 = run inline; inline when that is below 2, where the pool's IPC
+                          buys no parallelism)
+    ANALYSIS_POOL_START   multiprocessing start method for the workers (default: forkserver)
+    ANALYSIS_POOL_WARMUP  "1" to start the pool at app load and run one synthetic
+                          analysis in every worker before it takes jobs (default: 0)
+"""
+import os
+import asyncio
+import logging
+import threading
+import inspect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import metrics
+from bars import Bars
+from lazy_modules import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+
+
+def default_pool_size(app_processes=1):
+    """CPUs per app process, or 0 (inline) when that leaves fewer than 2 workers"""
+    size = (os.cpu_count() or 1) // max(app_processes, 1)
+    return size if size >= 2 else 0
+
+
+POOL_SIZE = int(os.environ['ANALYSIS_POOL_SIZE']) if 'ANALYSIS_POOL_SIZE' in os.environ else default_pool_size()
+POOL_WARMUP = os.environ.get('ANALYSIS_POOL_WARMUP', '0') == '1'
+POOL_START = os.environ.get('ANALYSIS_POOL_START', 'forkserver')
+
+# Python 3.13+ lets attaching processes opt out of the resource tracker
+_ATTACH_KWARGS = {'track': False} if 'track' in inspect.signature(shared_memory.SharedMemory).parameters else {}
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def share_bars(bars):
+    """Copy the arrays of a Bars container into a new shared memory block"""
+    rows = len(bars)
+    price_dtype = bars.close.dtype
+    # Layout: int64 timestamps, int64 volume, then open/high/low/close in the bars' price dtype
+    size = rows * 8 * 2 + rows * price_dtype.itemsize * len(PRICE_FIELDS)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    integers = np.ndarray((2, rows), dtype=np.int64, buffer=shm.buf)
+    integers[0] = bars.timestamps
+    integers[1] = bars.volume
+    prices = np.ndarray((len(PRICE_FIELDS), rows), dtype=price_dtype, buffer=shm.buf, offset=rows * 8 * 2)
+    for i, field in enumerate(PRICE_FIELDS):
+        prices[i] = getattr(bars, field)
+    del integers, prices
+
+    descriptor = {'name': shm.name, 'rows': rows, 'dtype': price_dtype.str, 'tz': bars.tz}
+    return shm, descriptor
+
+
+def attach_bars(descriptor):
+    """Rebuild Bars from a shared memory descriptor"""
+    rows = descriptor['rows']
+    shm = shared_memory.SharedMemory(name=descriptor['name'], **_ATTACH_KWARGS)
+    try:
+        # Copy out of the block so it can be closed while the bars are still in use
+        integers = np.ndarray((2, rows), dtype=np.int64, buffer=shm.buf).copy()
+        prices = np.ndarray((len(PRICE_FIELDS), rows), dtype=np.dtype(descriptor['dtype']), buffer=shm.buf, offset=rows * 8 * 2).copy()
+    finally:
+        shm.close()
+
+    return Bars(integers[0], *prices, integers[1], tz=descriptor['tz'])
+
+
+def _analyze_shared(analyze, descriptor, timeframe, symbol):
+    """Worker entry point: attach to shared bars, run analyze on them and return the result with its stage timings"""
+    with metrics.collect_stages() as stages:
+        analysis = analyze(attach_bars(descriptor), timeframe, symbol)
+    return analysis, stages
+
+
+def _unpack_results(results):
+    """Record worker stage timings in this process and return the bare analyses"""
+    analyses = []
+    for analysis, stages in results:
+        metrics.replay_stages(stages)
+        analyses.append(analysis)
+    return analyses
+
+
+def synthetic_ohlcv(rows=300):
+    """Deterministic random-walk OHLCV frame used for warm-up"""
+    rng = np.random.default_rng(0)
+    close = 100 + np.cumsum(rng.normal(0, 1, rows))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.5, rows))
+    index = pd.date_range('2024-01-01', periods=rows, freq='h', tz='UTC')
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.integers(1_000, 100_000, rows).astype(np.float64)
+    }, index=index)
+
+
+def _warm_up_worker():
+    """Pool initializer: exercise the pandas/numpy code paths once"""
+    from app import perform_comprehensive_analysis
+    perform_comprehensive_analysis(synthetic_ohlcv(), '1h', 'WARMUP')
+
+
+def _mp_context():
+    """Start method for pool workers: POOL_START if supported here, else spawn"""
+    method = POOL_START if POOL_START in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        context.set_forkserver_preload(['numpy', 'pandas', 'app'])
+    return context
+
+
+def get_executor():
+    """Return this process's analysis pool, creating it on first use (None when disabled)"""
+    global _executor, _executor_pid
+    if POOL_SIZE <= 0:
+        return None
+    with _lock:
+        # A pool inherited across fork (e.g. gunicorn --preload) is not usable in the child
+        if _executor is None or _executor_pid != os.getpid():
+            context = _mp_context()
+            _executor = ProcessPoolExecutor(
+                max_workers=POOL_SIZE,
+                mp_context=context,
+                initializer=_warm_up_worker if POOL_WARMUP else None
+            )
+            _executor_pid = os.getpid()
+            logging.info(f"Analysis pool started with {POOL_SIZE} {context.get_start_method()} workers (warm-up: {POOL_WARMUP})")
+        return _executor
+
+
+def start():
+    """Start the pool eagerly and wait until every worker has finished its warm-up"""
+    executor = get_executor()
+    if executor is not None:
+        for future in [executor.submit(os.getpid) for _ in range(POOL_SIZE)]:
+            future.result()
+
+
+def shutdown():
+    """Stop the pool owned by this process"""
+    global _executor
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+def run_analyses(jobs, analyze):
+    """
+    Run analyze(bars, timeframe, symbol) for every job, in parallel on the pool.
+    analyze is pickled by reference, so it must be a module-level function.
+    Falls back to calling analyze inline when the pool is disabled or broken.
+    Results are returned in job order.
+    """
+    executor = get_executor()
+    if executor is None:
+        return [analyze(bars, timeframe, symbol) for bars, timeframe, symbol in jobs]
+
+    blocks = []
+    try:
+        futures = []
+        for bars, timeframe, symbol in jobs:
+            shm, descriptor = share_bars(bars)
+            blocks.append(shm)
+            futures.append(executor.submit(_analyze_shared, analyze, descriptor, timeframe, symbol))
+        return _unpack_results([future.result() for future in futures])
+    except BrokenProcessPool as e:
+        logging.error(f"Analysis pool failed, running inline: {str(e)}")
+        shutdown()
+        return [analyze(bars, timeframe, symbol) for bars, timeframe, symbol in jobs]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+async def run_analyses_async(jobs, analyze):
+    """Awaitable run_analyses for the ASGI app; the event loop is never blocked on analysis"""
+    executor = get_executor()
+    if executor is None:
+        return await asyncio.to_thread(lambda: [analyze(bars, timeframe, symbol) for bars, timeframe, symbol in jobs])
+
+    blocks = []
+    try:
+        futures = []
+        for bars, timeframe, symbol in jobs:
+            shm, descriptor = share_bars(bars)
+            blocks.append(shm)
+            futures.append(asyncio.wrap_future(executor.submit(_analyze_shared, analyze, descriptor, timeframe, symbol)))
+        return _unpack_results(await asyncio.gather(*futures))
+    except BrokenProcessPool as e:
+        logging.error(f"Analysis pool failed, running inline: {str(e)}")
+        shutdown()
+        return await asyncio.to_thread(lambda: [analyze(bars, timeframe, symbol) for bars, timeframe, symbol in jobs])
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
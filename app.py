@@ -1,28 +1,50 @@
 import os
+import math
+import asyncio
+import time
+_IMPORT_STARTED = time.perf_counter()
 from flask import Flask, request, jsonify
-import yfinance as yf
-import requests
 import json
 from datetime import datetime, timedelta
 import logging
-import pandas as pd
-import numpy as np
+import lazy_modules
+from lazy_modules import lazy_import
+import analysis_pool
+import metrics
+import result_cache
+import upstream
+from bars import Bars, as_bars, as_price
+from structure import MarketStructure, swing_point_positions
+
+# The analysis stack is imported on first use so /health and /symbols answer
+# immediately; gunicorn.conf.py loads it in the master before forking workers
+requests = lazy_import('requests')
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+ANALYSIS_WARMUP = os.environ.get('ANALYSIS_WARMUP', '0') == '1'
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def calculate_volume_profile(df, num_levels=20):
+def calculate_volume_profile(bars, num_levels=20):
     """
     Calculate Volume Profile (volume distribution by price levels)
     Returns volume traded at each price level
     """
     try:
-        if df.empty or 'High' not in df.columns or 'Low' not in df.columns or 'Volume' not in df.columns:
+        if len(bars) == 0:
             return []
         
-        # Calculate price range
-        price_min = df['Low'].min()
-        price_max = df['High'].max()
+        # Accumulate in float64 (see precision contract in bars.py)
+        low = bars.low.astype(np.float64)
+        high = bars.high.astype(np.float64)
+        volume = bars.volume.astype(np.float64)
+        candle_range = high - low
+        
+        # Calculate price range, on the same float64 values the overlaps use
+        price_min = float(np.nanmin(low))
+        price_max = float(np.nanmax(high))
         
         # Create price levels
         price_levels = np.linspace(price_min, price_max, num_levels + 1)
@@ -33,23 +55,10 @@ def calculate_volume_profile(df, num_levels=20):
             level_high = price_levels[i + 1]
             level_mid = (level_low + level_high) / 2
             
-            # Calculate volume for this price level
-            level_volume = 0
-            
-            for idx, row in df.iterrows():
-                candle_low = row['Low']
-                candle_high = row['High']
-                candle_volume = row['Volume']
-                
-                # Calculate overlap between candle range and price level
-                overlap_low = max(level_low, candle_low)
-                overlap_high = min(level_high, candle_high)
-                
-                if overlap_high > overlap_low:
-                    candle_range = candle_high - candle_low
-                    if candle_range > 0:
-                        overlap_fraction = (overlap_high - overlap_low) / candle_range
-                        level_volume += candle_volume * overlap_fraction
+            # Overlap between every candle range and this price level
+            overlap = np.minimum(level_high, high) - np.maximum(level_low, low)
+            counted = (overlap > 0) & (candle_range > 0)
+            level_volume = np.sum(volume[counted] * overlap[counted] / candle_range[counted])
             
             volume_profile.append({
                 "price_level": round(level_mid, 2),
@@ -76,102 +85,86 @@ def calculate_ema(prices, period):
         return pd.Series(dtype=float)
     
     alpha = 2 / (period + 1)
-    ema = prices.ewm(alpha=alpha, adjust=False).mean()
+    ema = pd.Series(np.asarray(prices, dtype=np.float64)).ewm(alpha=alpha, adjust=False).mean()
     return ema
 
-def detect_swing_points(df, window=5):
+def detect_swing_points(bars, window=5):
     """Detect swing highs and lows"""
-    highs = []
-    lows = []
+    high_positions, low_positions = swing_point_positions(bars, window)
     
-    for i in range(window, len(df) - window):
-        # Check for swing high
-        is_high = all(df['High'].iloc[i] >= df['High'].iloc[j] for j in range(i - window, i + window + 1) if j != i)
-        if is_high:
-            highs.append({'index': i, 'price': df['High'].iloc[i], 'timestamp': df.index[i].strftime('%Y-%m-%d %H:%M:%S'), 'type': 'swing_high'})
-        
-        # Check for swing low
-        is_low = all(df['Low'].iloc[i] <= df['Low'].iloc[j] for j in range(i - window, i + window + 1) if j != i)
-        if is_low:
-            lows.append({'index': i, 'price': df['Low'].iloc[i], 'timestamp': df.index[i].strftime('%Y-%m-%d %H:%M:%S'), 'type': 'swing_low'})
+    highs = [
+        {'index': int(i), 'price': as_price(bars.high[i]), 'timestamp': timestamp, 'type': 'swing_high'}
+        for i, timestamp in zip(high_positions, bars.format_times(high_positions))
+    ]
+    lows = [
+        {'index': int(i), 'price': as_price(bars.low[i]), 'timestamp': timestamp, 'type': 'swing_low'}
+        for i, timestamp in zip(low_positions, bars.format_times(low_positions))
+    ]
     
     return highs, lows
 
-def detect_structure_levels(df):
-    """Detect HH, LL, iBOS, ChoCH"""
-    highs, lows = detect_swing_points(df)
-    
-    structure = {'higher_highs': [], 'lower_lows': [], 'internal_bos': [], 'change_of_character': []}
-    
-    # Higher Highs
-    for i in range(1, len(highs)):
-        if highs[i]['price'] > highs[i-1]['price']:
-            structure['higher_highs'].append(highs[i])
-    
-    # Lower Lows  
-    for i in range(1, len(lows)):
-        if lows[i]['price'] < lows[i-1]['price']:
-            structure['lower_lows'].append(lows[i])
-    
-    return structure
+def detect_structure_levels(bars):
+    """Detect HH, HL, LH, LL, internal and swing BOS/ChoCH and the current trend (see structure.py)"""
+    return MarketStructure().update(bars).to_dict(bars)
 
-def detect_order_blocks(df, window=20):
+def detect_order_blocks(bars, window=20):
     """Detect Order Blocks (institutional candles before strong moves)"""
-    order_blocks = []
-    
-    for i in range(window, len(df) - 1):
-        current = df.iloc[i]
-        next_candle = df.iloc[i + 1]
-        
-        # Bullish Order Block
-        if (current['Close'] < current['Open'] and next_candle['Close'] > next_candle['Open'] and 
-            next_candle['Close'] > current['High']):
-            order_blocks.append({
-                'type': 'bullish_ob', 'high': current['High'], 'low': current['Low'],
-                'timestamp': current.name.strftime('%Y-%m-%d %H:%M:%S'), 'index': i
-            })
-        
-        # Bearish Order Block
-        elif (current['Close'] > current['Open'] and next_candle['Close'] < next_candle['Open'] and
-              next_candle['Close'] < current['Low']):
-            order_blocks.append({
-                'type': 'bearish_ob', 'high': current['High'], 'low': current['Low'],
-                'timestamp': current.name.strftime('%Y-%m-%d %H:%M:%S'), 'index': i
-            })
+    n = len(bars)
+    if n - 1 <= window:
+        return []
+    
+    open_, high, low, close = bars.open, bars.high, bars.low, bars.close
+    current = slice(window, n - 1)
+    next_candle = slice(window + 1, n)
     
-    return order_blocks[-10:]
+    # Bullish Order Block: bearish candle engulfed upwards by the next one
+    bullish = (close[current] < open_[current]) & (close[next_candle] > open_[next_candle]) & (close[next_candle] > high[current])
+    # Bearish Order Block: bullish candle engulfed downwards by the next one
+    bearish = (close[current] > open_[current]) & (close[next_candle] < open_[next_candle]) & (close[next_candle] < low[current])
+    
+    positions = np.flatnonzero(bullish | bearish)[-10:] + window
+    return [
+        {
+            'type': 'bullish_ob' if bullish[i - window] else 'bearish_ob', 'high': as_price(high[i]), 'low': as_price(low[i]),
+            'timestamp': timestamp, 'index': int(i)
+        }
+        for i, timestamp in zip(positions, bars.format_times(positions))
+    ]
 
-def detect_fair_value_gaps(df):
+def detect_fair_value_gaps(bars):
     """Detect Fair Value Gaps (FVGs)"""
-    fvgs = []
+    if len(bars) < 3:
+        return []
     
-    for i in range(1, len(df) - 1):
-        prev, current, next_candle = df.iloc[i-1], df.iloc[i], df.iloc[i+1]
-        
-        # Bullish FVG
-        if prev['Low'] > next_candle['High']:
+    high, low = bars.high, bars.low
+    
+    # Gap between the candles either side of each middle candle
+    bullish = low[:-2] > high[2:]
+    bearish = high[:-2] < low[2:]
+    
+    positions = np.flatnonzero(bullish | bearish)[-20:] + 1
+    fvgs = []
+    for i, timestamp in zip(positions, bars.format_times(positions)):
+        if bullish[i - 1]:
             fvgs.append({
-                'type': 'bullish_fvg', 'high': prev['Low'], 'low': next_candle['High'],
-                'timestamp': current.name.strftime('%Y-%m-%d %H:%M:%S'), 'index': i
+                'type': 'bullish_fvg', 'high': as_price(low[i - 1]), 'low': as_price(high[i + 1]),
+                'timestamp': timestamp, 'index': int(i)
             })
-        
-        # Bearish FVG  
-        elif prev['High'] < next_candle['Low']:
+        else:
             fvgs.append({
-                'type': 'bearish_fvg', 'high': next_candle['Low'], 'low': prev['High'],
-                'timestamp': current.name.strftime('%Y-%m-%d %H:%M:%S'), 'index': i
+                'type': 'bearish_fvg', 'high': as_price(low[i + 1]), 'low': as_price(high[i - 1]),
+                'timestamp': timestamp, 'index': int(i)
             })
     
-    return fvgs[-20:]
+    return fvgs
 
-def calculate_premium_discount_zones(df, window=50):
+def calculate_premium_discount_zones(bars, window=50):
     """Calculate Premium/Discount zones based on swing range"""
-    if len(df) < window:
+    if len(bars) < window:
         return None
     
-    recent_data = df.tail(window)
-    swing_high = recent_data['High'].max()
-    swing_low = recent_data['Low'].min()
+    swing_high = as_price(np.nanmax(bars.high[-window:]))
+    swing_low = as_price(np.nanmin(bars.low[-window:]))
     range_size = swing_high - swing_low
     
     levels = {
@@ -182,7 +175,7 @@ def calculate_premium_discount_zones(df, window=50):
         'swing_low': swing_low
     }
     
-    current_price = df['Close'].iloc[-1]
+    current_price = as_price(bars.close[-1])
     
     if current_price > levels['equilibrium']:
         bias = 'premium' if current_price > levels['premium_zone'] else 'neutral_premium'
@@ -191,9 +184,9 @@ def calculate_premium_discount_zones(df, window=50):
     
     return {'levels': levels, 'current_bias': bias, 'current_price': current_price}
 
-def detect_liquidity_zones(df):
+def detect_liquidity_zones(bars):
     """Detect equal highs/lows (liquidity zones)"""
-    highs, lows = detect_swing_points(df)
+    highs, lows = detect_swing_points(bars)
     liquidity_zones = {'equal_highs': [], 'equal_lows': []}
     tolerance = 0.005
     
@@ -302,56 +295,66 @@ def generate_trading_signals(analysis, timeframe):
         logging.error(f"Error generating trading signals: {str(e)}")
         return signals
 
-def perform_comprehensive_analysis(df, timeframe, symbol):
-    """Perform comprehensive multi-timeframe analysis with SMC"""
+def perform_comprehensive_analysis(bars, timeframe, symbol):
+    """Perform comprehensive multi-timeframe analysis with SMC on Bars (or a ticker.history() frame)"""
     try:
+        bars = as_bars(bars)
+        close = bars.close
         analysis = {
             'timeframe': timeframe,
-            'data_points': len(df),
-            'current_price': round(float(df['Close'].iloc[-1]), 2),
-            'price_change_24h': round(float(df['Close'].iloc[-1] - df['Close'].iloc[-2]), 2) if len(df) > 1 else 0,
+            'data_points': len(bars),
+            'current_price': round(as_price(close[-1]), 2),
+            'price_change_24h': round(as_price(close[-1]) - as_price(close[-2]), 2) if len(bars) > 1 else 0,
             'chart_data': []
         }
         
         # Convert chart data (last 100 candles)
-        for index, row in df.tail(100).iterrows():
-            analysis['chart_data'].append({
-                "date": index.strftime('%Y-%m-%d %H:%M:%S'),
-                "timestamp": int(index.timestamp()),
-                "open": round(float(row['Open']), 2),
-                "high": round(float(row['High']), 2),
-                "low": round(float(row['Low']), 2),
-                "close": round(float(row['Close']), 2),
-                "volume": int(row['Volume']) if row['Volume'] else 0
-            })
+        with metrics.stage('chart_data', timeframe):
+            recent = bars.tail(100)
+            for i, date in enumerate(recent.format_times()):
+                analysis['chart_data'].append({
+                    "date": date,
+                    "timestamp": int(recent.timestamps[i]),
+                    "open": round(as_price(recent.open[i]), 2),
+                    "high": round(as_price(recent.high[i]), 2),
+                    "low": round(as_price(recent.low[i]), 2),
+                    "close": round(as_price(recent.close[i]), 2),
+                    "volume": int(recent.volume[i])
+                })
         
         # 20 EMA for dynamic support/resistance
-        if len(df) >= 20:
-            ema_20 = calculate_ema(df['Close'], 20)
-            if not ema_20.empty:
-                analysis['ema_20'] = {
-                    'current': round(float(ema_20.iloc[-1]), 2),
-                    'previous': round(float(ema_20.iloc[-2]), 2) if len(ema_20) > 1 else None,
-                    'trend': 'bullish' if len(ema_20) > 1 and ema_20.iloc[-1] > ema_20.iloc[-2] else 'bearish' if len(ema_20) > 1 else 'neutral',
-                    'price_vs_ema': 'above' if df['Close'].iloc[-1] > ema_20.iloc[-1] else 'below'
-                }
+        if len(bars) >= 20:
+            with metrics.stage('ema_20', timeframe):
+                ema_20 = calculate_ema(close, 20)
+                if not ema_20.empty:
+                    analysis['ema_20'] = {
+                        'current': round(float(ema_20.iloc[-1]), 2),
+                        'previous': round(float(ema_20.iloc[-2]), 2) if len(ema_20) > 1 else None,
+                        'trend': 'bullish' if len(ema_20) > 1 and ema_20.iloc[-1] > ema_20.iloc[-2] else 'bearish' if len(ema_20) > 1 else 'neutral',
+                        'price_vs_ema': 'above' if close[-1] > ema_20.iloc[-1] else 'below'
+                    }
         
         # Volume Profile
-        analysis['volume_profile'] = calculate_volume_profile(df)
+        with metrics.stage('volume_profile', timeframe):
+            analysis['volume_profile'] = calculate_volume_profile(bars)
         
         # Smart Money Concepts
-        analysis['smart_money_concepts'] = {
-            'structure_levels': detect_structure_levels(df),
-            'order_blocks': detect_order_blocks(df),
-            'fair_value_gaps': detect_fair_value_gaps(df),
-            'liquidity_zones': detect_liquidity_zones(df)
-        }
+        smc = analysis['smart_money_concepts'] = {}
+        with metrics.stage('structure_levels', timeframe):
+            smc['structure_levels'] = detect_structure_levels(bars)
+        with metrics.stage('order_blocks', timeframe):
+            smc['order_blocks'] = detect_order_blocks(bars)
+        with metrics.stage('fair_value_gaps', timeframe):
+            smc['fair_value_gaps'] = detect_fair_value_gaps(bars)
+        with metrics.stage('liquidity_zones', timeframe):
+            smc['liquidity_zones'] = detect_liquidity_zones(bars)
         
         # Premium/Discount Zones (for Daily and 4H)
         if timeframe in ['1d', '4h']:
-            premium_discount = calculate_premium_discount_zones(df)
+            with metrics.stage('premium_discount', timeframe):
+                premium_discount = calculate_premium_discount_zones(bars)
             if premium_discount:
-                analysis['smart_money_concepts']['premium_discount'] = premium_discount
+                smc['premium_discount'] = premium_discount
         
         # Timeframe-specific context
         contexts = {
@@ -366,7 +369,8 @@ def perform_comprehensive_analysis(df, timeframe, symbol):
             analysis['purpose'] = contexts[timeframe][1]
         
         # Trading signals based on SMC
-        analysis['trading_signals'] = generate_trading_signals(analysis, timeframe)
+        with metrics.stage('signals', timeframe):
+            analysis['trading_signals'] = generate_trading_signals(analysis, timeframe)
         
         return analysis
         
@@ -374,96 +378,271 @@ def perform_comprehensive_analysis(df, timeframe, symbol):
         logging.error(f"Error in comprehensive analysis for {timeframe}: {str(e)}")
         return {'error': f"Analysis failed for {timeframe}: {str(e)}"}
 
+POPULAR_SYMBOLS = {
+    "stocks": {
+        "tech": ["AAPL", "GOOGL", "MSFT", "AMZN", "TSLA", "META", "NVDA"],
+        "finance": ["JPM", "BAC", "WFC", "GS", "MS"],
+        "indices": ["^GSPC", "^DJI", "^IXIC", "^RUT"]
+    },
+    "commodities": {
+        "metals": ["GC=F", "SI=F", "PL=F", "PA=F"],
+        "energy": ["CL=F", "NG=F", "BZ=F"],
+        "agriculture": ["ZC=F", "ZS=F", "ZW=F"]
+    },
+    "crypto": ["BTC-USD", "ETH-USD", "BNB-USD", "XRP-USD", "ADA-USD"],
+    "forex": ["EURUSD=X", "GBPUSD=X", "USDJPY=X", "AUDUSD=X"]
+}
+
+def parse_chart_request(data):
+    """Validate a /chart-data payload; returns (params, error message)"""
+    if not data:
+        return None, "No JSON data provided"
+    
+    params = {
+        'symbol': data.get('symbol', '').upper(),
+        'timeframes': data.get('timeframes', ['1d', '4h', '1h', '15m']),
+        'analysis_period': data.get('analysis_period', '3mo'),
+        'callback_url': data.get('callback_url')  # Optional webhook URL
+    }
+    
+    if not params['symbol']:
+        return None, "Symbol is required"
+    
+    return params, None
+
+def build_chart_response(symbol, info, timeframes, analysis_period, mtf_analysis):
+    """Assemble the /chart-data response body"""
+    return {
+        "symbol": symbol,
+        "company_name": info.get('longName', symbol),
+        "currency": info.get('currency', 'USD'),
+        "analysis_period": analysis_period,
+        "timeframes_analyzed": timeframes,
+        "multi_timeframe_analysis": mtf_analysis,
+        "metadata": {
+            "current_price": mtf_analysis.get('1d', {}).get('current_price'),
+            "market_cap": info.get('marketCap'),
+            "pe_ratio": info.get('trailingPE'),
+            "52_week_high": info.get('fiftyTwoWeekHigh'),
+            "52_week_low": info.get('fiftyTwoWeekLow')
+        },
+        "fetched_at": datetime.now().isoformat()
+    }
+
+def analysis_jobs(symbol, histories):
+    """
+    Split fetched Bars per timeframe into pool jobs; returns (mtf_analysis, jobs) where
+    mtf_analysis already holds errors for empty timeframes, in requested order.
+    """
+    mtf_analysis = {}
+    jobs = []
+    
+    for tf, bars in histories.items():
+        if len(bars) == 0:
+            mtf_analysis[tf] = {"error": f"No data available for {tf} timeframe"}
+            continue
+        
+        mtf_analysis[tf] = None  # filled in once the job has run
+        jobs.append((bars, tf, symbol))
+    
+    return mtf_analysis, jobs
+
+class ChartFetches:
+    """
+    Upstream calls of one /chart-data request: a history per timeframe, queued
+    at once, then info only if the result cache missed. All of them are awaited
+    against one UPSTREAM_TIMEOUT deadline, so the request never waits a full
+    timeout per call.
+    """
+    
+    def __init__(self, symbol, timeframes, analysis_period):
+        self.symbol = symbol
+        self.timeframes = list(timeframes)
+        self.started = time.perf_counter()
+        self.deadline = self.started + upstream.UPSTREAM_TIMEOUT
+        self.finished = {}
+        self.futures = [upstream.submit('history', symbol, analysis_period, tf) for tf in self.timeframes]
+        for tf, future in zip(self.timeframes, self.futures):
+            future.add_done_callback(lambda _, tf=tf: self.finished.setdefault(tf, time.perf_counter()))
+    
+    def _unpack(self, results):
+        """timeframe -> Bars; fetch stages time each call from submission"""
+        for tf in self.timeframes:
+            metrics.record_stage('fetch', self.finished.get(tf, time.perf_counter()) - self.started, tf)
+        return {tf: Bars.from_frame(frame) for tf, frame in zip(self.timeframes, results)}
+    
+    def _remaining(self):
+        return max(self.deadline - time.perf_counter(), 0)
+    
+    def wait(self):
+        return self._unpack(upstream.gather(self.futures, self._remaining()))
+    
+    async def wait_async(self):
+        results = await upstream.gather_async(self.futures, self._remaining())
+        # Bar conversion is CPU work; keep it off the event loop
+        return await asyncio.to_thread(self._unpack, results)
+    
+    def info(self):
+        """ticker.info, with whatever is left of the request's deadline"""
+        with metrics.stage('metadata'):
+            return upstream.gather([upstream.submit('info', self.symbol)], self._remaining())[0]
+    
+    async def info_async(self):
+        with metrics.stage('metadata'):
+            return (await upstream.gather_async([upstream.submit('info', self.symbol)], self._remaining()))[0]
+
+def webhook_summary(symbol, timeframes, mtf_analysis, webhook_status):
+    """Response returned to the caller once the analysis was delivered to its webhook"""
+    return {
+        "message": "Analysis completed and sent to webhook",
+        "webhook_status": webhook_status,
+        "analysis_summary": {
+            "symbol": symbol,
+            "timeframes": timeframes,
+            "data_points": sum(tf_data.get('data_points', 0) for tf_data in mtf_analysis.values() if isinstance(tf_data, dict) and 'data_points' in tf_data)
+        }
+    }
+
+def upstream_unavailable(error):
+    """503 body and headers for a request the upstream scheduler could not serve"""
+    retry_after = math.ceil(error.retry_after or upstream.UPSTREAM_BACKOFF)
+    return {"error": f"Market data temporarily unavailable: {str(error)}", "retry_after": retry_after}, {'Retry-After': str(retry_after)}
+
+def is_profile_request(args):
+    """True when the caller asked for the per-stage breakdown with ?profile=1"""
+    return args.get('profile') in ('1', 'true')
+
+def load_analysis_stack():
+    """Import pandas, numpy, yfinance and requests now instead of on first use"""
+    started = time.perf_counter()
+    if lazy_modules.load():
+        metrics.record_startup('analysis_stack', time.perf_counter() - started)
+
+_warmed_up_pid = None
+
+def warm_up():
+    """Prepare this worker process before it takes traffic (runs once per process)"""
+    global _warmed_up_pid
+    if _warmed_up_pid == os.getpid():
+        return
+    _warmed_up_pid = os.getpid()
+    
+    if ANALYSIS_WARMUP or analysis_pool.POOL_WARMUP:
+        # Sharing bars with the pool needs numpy here too; load it before taking traffic
+        load_analysis_stack()
+    
+    if ANALYSIS_WARMUP:
+        # Keep the synthetic run out of the stage latency histograms
+        with metrics.startup_phase('warmup'), metrics.collect_stages():
+            perform_comprehensive_analysis(analysis_pool.synthetic_ohlcv(), '1h', 'WARMUP')
+    
+    if analysis_pool.POOL_WARMUP:
+        with metrics.startup_phase('analysis_pool'):
+            analysis_pool.start()
+
+def profiled_response(payload, profile_requested, status=200):
+    """JSON response whose serialization is timed and which optionally carries the stage breakdown"""
+    with metrics.stage('serialization'):
+        body = app.json.dumps(payload)
+    profile = metrics.current_profile()
+    if profile_requested and profile is not None:
+        # Serialize again so the breakdown includes the serialization stage itself
+        body = app.json.dumps(dict(payload, profile=profile.summary()))
+    return app.response_class(body + '\n', status=status, mimetype=app.json.mimetype)
+
+def cached_response(entry, cache_hit):
+    """Serve a cached result: 304 on a matching If-None-Match, else the best precompressed body"""
+    encoding, body = entry.negotiate(request.headers.get('Accept-Encoding'))
+    headers = result_cache.cache_headers(entry, encoding, cache_hit)
+    if entry.matches(request.headers.get('If-None-Match')):
+        headers.pop('Content-Encoding', None)
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(body, mimetype=app.json.mimetype, headers=headers)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
 
 @app.route('/chart-data', methods=['POST'])
+@metrics.instrument('chart-data')
 def get_chart_data():
     """Multi-timeframe analysis with Smart Money Concepts"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
+        profile_requested = is_profile_request(request.args)
+        load_analysis_stack()
+        params, error = parse_chart_request(request.get_json())
+        if error:
+            return jsonify({"error": error}), 400
         
-        symbol = data.get('symbol', '').upper()
-        timeframes = data.get('timeframes', ['1d', '4h', '1h', '15m'])
-        analysis_period = data.get('analysis_period', '3mo')
-        callback_url = data.get('callback_url')  # Optional webhook URL
-        
-        if not symbol:
-            return jsonify({"error": "Symbol is required"}), 400
+        symbol = params['symbol']
+        timeframes = params['timeframes']
+        analysis_period = params['analysis_period']
+        callback_url = params['callback_url']
         
         logging.info(f"Multi-timeframe analysis for {symbol} on timeframes: {timeframes}")
         
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        
-        # Multi-timeframe analysis
-        mtf_analysis = {}
-        
-        for tf in timeframes:
-            logging.info(f"Analyzing {symbol} on {tf} timeframe")
-            hist_data = ticker.history(period=analysis_period, interval=tf)
+        fetches = ChartFetches(symbol, timeframes, analysis_period)
+        histories = fetches.wait()
+        
+        # Profiled requests always recompute so the breakdown reflects a real analysis
+        use_cache = result_cache.results.enabled and not profile_requested
+        entry = None
+        if use_cache:
+            cache_key = result_cache.cache_key(params, histories)
+            entry = result_cache.results.get(cache_key)
+            metrics.record_cache('result', entry is not None)
+        cache_hit = entry is not None
+        
+        if cache_hit:
+            response_data = entry.data
+        else:
+            # CPU-bound detectors run on the process pool, one job per timeframe
+            mtf_analysis, jobs = analysis_jobs(symbol, histories)
+            results = analysis_pool.run_analyses(jobs, perform_comprehensive_analysis)
+            for (_, tf, _), analysis in zip(jobs, results):
+                mtf_analysis[tf] = analysis
             
-            if hist_data.empty:
-                mtf_analysis[tf] = {"error": f"No data available for {tf} timeframe"}
-                continue
-            
-            analysis = perform_comprehensive_analysis(hist_data, tf, symbol)
-            mtf_analysis[tf] = analysis
+            response_data = build_chart_response(symbol, fetches.info(), timeframes, analysis_period, mtf_analysis)
+            if use_cache:
+                with metrics.stage('serialization'):
+                    entry = result_cache.results.put(cache_key, response_data, app.json.dumps(response_data).encode('utf-8') + b'\n')
         
-        response_data = {
-            "symbol": symbol,
-            "company_name": info.get('longName', symbol),
-            "currency": info.get('currency', 'USD'),
-            "analysis_period": analysis_period,
-            "timeframes_analyzed": timeframes,
-            "multi_timeframe_analysis": mtf_analysis,
-            "metadata": {
-                "current_price": mtf_analysis.get('1d', {}).get('current_price'),
-                "market_cap": info.get('marketCap'),
-                "pe_ratio": info.get('trailingPE'),
-                "52_week_high": info.get('fiftyTwoWeekHigh'),
-                "52_week_low": info.get('fiftyTwoWeekLow')
-            },
-            "fetched_at": datetime.now().isoformat()
-        }
+        mtf_analysis = response_data['multi_timeframe_analysis']
         
         # Send to callback URL if provided (webhook functionality)
         if callback_url:
             try:
                 logging.info(f"Sending webhook to {callback_url}")
-                webhook_response = requests.post(
-                    callback_url,
-                    json=response_data,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=30
-                )
+                with metrics.stage('webhook'):
+                    webhook_response = requests.post(
+                        callback_url,
+                        data=entry.body if entry is not None else app.json.dumps(response_data).encode('utf-8'),
+                        headers={'Content-Type': 'application/json'},
+                        timeout=30
+                    )
                 logging.info(f"Webhook sent, status: {webhook_response.status_code}")
                 
-                return jsonify({
-                    "message": "Analysis completed and sent to webhook",
-                    "webhook_status": webhook_response.status_code,
-                    "analysis_summary": {
-                        "symbol": symbol,
-                        "timeframes": timeframes,
-                        "data_points": sum(tf_data.get('data_points', 0) for tf_data in mtf_analysis.values() if isinstance(tf_data, dict) and 'data_points' in tf_data)
-                    }
-                })
+                return profiled_response(webhook_summary(symbol, timeframes, mtf_analysis, webhook_response.status_code), profile_requested)
                 
             except requests.exceptions.RequestException as e:
                 logging.error(f"Webhook failed: {str(e)}")
                 # Return the data even if webhook fails
-                return jsonify({
+                return profiled_response({
                     "message": "Analysis completed but webhook failed",
                     "webhook_error": str(e),
                     "data": response_data
-                }), 207  # Multi-status
+                }, profile_requested, 207)  # Multi-status
         
         # Return data directly if no callback URL
-        return jsonify(response_data)
+        if entry is not None:
+            return cached_response(entry, cache_hit)
+        return profiled_response(response_data, profile_requested)
+        
+    except upstream.UpstreamUnavailable as e:
+        logging.error(f"Upstream unavailable: {str(e)}")
+        payload, headers = upstream_unavailable(e)
+        return jsonify(payload), 503, headers
         
     except Exception as e:
         logging.error(f"Error processing request: {str(e)}")
@@ -472,21 +651,14 @@ def get_chart_data():
 @app.route('/symbols', methods=['GET'])
 def get_popular_symbols():
     """Return list of popular stock and commodity symbols"""
-    symbols = {
-        "stocks": {
-            "tech": ["AAPL", "GOOGL", "MSFT", "AMZN", "TSLA", "META", "NVDA"],
-            "finance": ["JPM", "BAC", "WFC", "GS", "MS"],
-            "indices": ["^GSPC", "^DJI", "^IXIC", "^RUT"]
-        },
-        "commodities": {
-            "metals": ["GC=F", "SI=F", "PL=F", "PA=F"],
-            "energy": ["CL=F", "NG=F", "BZ=F"],
-            "agriculture": ["ZC=F", "ZS=F", "ZW=F"]
-        },
-        "crypto": ["BTC-USD", "ETH-USD", "BNB-USD", "XRP-USD", "ADA-USD"],
-        "forex": ["EURUSD=X", "GBPUSD=X", "USDJPY=X", "AUDUSD=X"]
-    }
-    return jsonify(symbols)
+    return jsonify(POPULAR_SYMBOLS)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics: request and per-stage latency histograms, cache hit ratios"""
+    return app.response_class(metrics.render_prometheus(), mimetype=None, content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+metrics.record_startup('app_import', time.perf_counter() - _IMPORT_STARTED)
 
 if __name__ == '__main__':
     print("🚀 Smart Money Concepts Multi-Timeframe Analysis Service starting...")
@@ -494,6 +666,7 @@ if __name__ == '__main__':
     print("   GET  /health - Health check")
     print("   POST /chart-data - Multi-timeframe SMC analysis")
     print("   GET  /symbols - List popular symbols")
+    print("   GET  /metrics - Prometheus metrics")
     print("\n🎯 Smart Money Concepts included:")
     print("   • Volume Profile with POC")
     print("   • 20 EMA dynamic support/resistance")
@@ -508,5 +681,7 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5003))
     debug = os.environ.get('FLASK_ENV') != 'production'
     
+    warm_up()
+    
     print(f"\n💡 Starting on port {port} (debug: {debug})")
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,309 @@
+"""
+ASGI serving mode for the Smart Money Concepts API.
+
+Exposes the same /health, /symbols and /chart-data endpoints as app.py, but
+request handlers never block the event loop:
+    - yfinance calls are awaited through the upstream scheduler (upstream.py)
+    - timeframes are fetched concurrently
+    - SMC analysis is offloaded to the analysis process pool, and bar
+      conversion, cache keys and result serialization to threads
+    - webhooks are delivered with an async HTTP client
+
+It also pushes live analysis deltas (see live_stream.py):
+    GET /stream?symbol=AAPL&timeframes=1d,1h   Server-Sent Events
+    WS  /ws?symbol=AAPL&timeframes=1d,1h       WebSocket, one JSON message per event
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+
+Environment:
+    STREAM_HEARTBEAT        seconds between SSE keep-alive comments (default: 15)
+"""
+import os
+import json
+import asyncio
+import logging
+import contextlib
+from datetime import datetime
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+import analysis_pool
+import lazy_modules
+import live_stream
+import metrics
+import result_cache
+import upstream
+from app import (
+    POPULAR_SYMBOLS, parse_chart_request, build_chart_response,
+    webhook_summary, perform_comprehensive_analysis, is_profile_request, analysis_jobs,
+    load_analysis_stack, warm_up, upstream_unavailable, ChartFetches
+)
+
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+_webhook_client = None
+_stream_hub = None
+
+
+def serialize(payload):
+    """JSON-encode a response body; like Flask's jsonify it tolerates NaN and non-JSON scalars"""
+    return json.dumps(payload, default=str).encode('utf-8')
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse rendered with serialize()"""
+
+    def render(self, content):
+        return serialize(content)
+
+
+def cached_response(request, entry, cache_hit):
+    """Serve a cached result: 304 on a matching If-None-Match, else the best precompressed body"""
+    encoding, body = entry.negotiate(request.headers.get('accept-encoding'))
+    headers = result_cache.cache_headers(entry, encoding, cache_hit)
+    if entry.matches(request.headers.get('if-none-match')):
+        headers.pop('Content-Encoding', None)
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def profiled_response(payload, profile_requested, status_code=200):
+    """JSONResponse whose serialization is timed and which optionally carries the stage breakdown"""
+    with metrics.stage('serialization'):
+        response = JSONResponse(payload, status_code=status_code)
+    profile = metrics.current_profile()
+    if profile_requested and profile is not None:
+        # Serialize again so the breakdown includes the serialization stage itself
+        response = JSONResponse(dict(payload, profile=profile.summary()), status_code=status_code)
+    return response
+
+
+def store_result(cache_key, response_data):
+    """Serialize, compress and cache a computed result; CPU work, run off the event loop"""
+    with metrics.stage('serialization'):
+        return result_cache.results.put(cache_key, response_data, serialize(response_data))
+
+
+async def send_webhook(callback_url, body):
+    """POST a serialized analysis to callback_url without blocking the event loop"""
+    with metrics.stage('webhook'):
+        return await _webhook_client.post(
+            callback_url,
+            content=body,
+            headers={'Content-Type': 'application/json'},
+            timeout=30
+        )
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({"status": "healthy", "timestamp": datetime.now().isoformat()})
+
+
+async def get_popular_symbols(request):
+    """Return list of popular stock and commodity symbols"""
+    return JSONResponse(POPULAR_SYMBOLS)
+
+
+async def get_metrics(request):
+    """Prometheus metrics: request and per-stage latency histograms, cache hit ratios"""
+    return Response(metrics.render_prometheus(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+@metrics.instrument('chart-data')
+async def get_chart_data(request):
+    """Multi-timeframe analysis with Smart Money Concepts"""
+    try:
+        profile_requested = is_profile_request(request.query_params)
+        if not lazy_modules.is_loaded():
+            await asyncio.to_thread(load_analysis_stack)
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        params, error = parse_chart_request(data)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        symbol = params['symbol']
+        timeframes = params['timeframes']
+        analysis_period = params['analysis_period']
+        callback_url = params['callback_url']
+
+        logging.info(f"Multi-timeframe analysis for {symbol} on timeframes: {timeframes}")
+
+        fetches = ChartFetches(symbol, timeframes, analysis_period)
+        histories = await fetches.wait_async()
+
+        # Profiled requests always recompute so the breakdown reflects a real analysis
+        use_cache = result_cache.results.enabled and not profile_requested
+        entry = None
+        if use_cache:
+            cache_key = await asyncio.to_thread(result_cache.cache_key, params, histories)
+            entry = result_cache.results.get(cache_key)
+            metrics.record_cache('result', entry is not None)
+        cache_hit = entry is not None
+
+        if cache_hit:
+            response_data = entry.data
+        else:
+            mtf_analysis, jobs = analysis_jobs(symbol, histories)
+            results = await analysis_pool.run_analyses_async(jobs, perform_comprehensive_analysis)
+            for (_, tf, _), analysis in zip(jobs, results):
+                mtf_analysis[tf] = analysis
+
+            info = await fetches.info_async()
+            response_data = build_chart_response(symbol, info, timeframes, analysis_period, mtf_analysis)
+            if use_cache:
+                entry = await asyncio.to_thread(store_result, cache_key, response_data)
+
+        mtf_analysis = response_data['multi_timeframe_analysis']
+
+        # Send to callback URL if provided (webhook functionality)
+        if callback_url:
+            try:
+                logging.info(f"Sending webhook to {callback_url}")
+                webhook_response = await send_webhook(callback_url, entry.body if entry is not None else serialize(response_data))
+                logging.info(f"Webhook sent, status: {webhook_response.status_code}")
+
+                return profiled_response(webhook_summary(symbol, timeframes, mtf_analysis, webhook_response.status_code), profile_requested)
+
+            # InvalidURL and the TypeError for a non-string URL are not HTTPErrors
+            except (httpx.HTTPError, httpx.InvalidURL, TypeError) as e:
+                logging.error(f"Webhook failed: {str(e)}")
+                # Return the data even if webhook fails
+                return profiled_response({
+                    "message": "Analysis completed but webhook failed",
+                    "webhook_error": str(e),
+                    "data": response_data
+                }, profile_requested, 207)  # Multi-status
+
+        # Return data directly if no callback URL
+        if entry is not None:
+            return cached_response(request, entry, cache_hit)
+        return profiled_response(response_data, profile_requested)
+
+    except upstream.UpstreamUnavailable as e:
+        logging.error(f"Upstream unavailable: {str(e)}")
+        payload, headers = upstream_unavailable(e)
+        return JSONResponse(payload, status_code=503, headers=headers)
+
+    except Exception as e:
+        logging.error(f"Error processing request: {str(e)}")
+        return JSONResponse({"error": f"Internal server error: {str(e)}"}, status_code=500)
+
+
+def parse_stream_request(query_params):
+    """Validate /stream and /ws query parameters; returns (symbol, timeframes, error message)"""
+    symbol = query_params.get('symbol', '').upper()
+    timeframes = [tf.strip() for tf in query_params.get('timeframes', '1d').split(',') if tf.strip()]
+    if not symbol:
+        return None, None, "Symbol is required"
+    if not timeframes:
+        return None, None, "At least one timeframe is required"
+    return symbol, timeframes, None
+
+
+async def stream_events(subscription):
+    """(event_type, json) pairs for one subscriber; None when the heartbeat interval passes quietly"""
+    while True:
+        event = await subscription.next_event(STREAM_HEARTBEAT)
+        if event is not None and event[0] == live_stream.RESYNC:
+            for resync_event in _stream_hub.resync_events(subscription):
+                yield resync_event
+            continue
+        yield event
+
+
+async def stream_updates(request):
+    """Server-Sent Events feed of live SMC deltas for one symbol"""
+    symbol, timeframes, error = parse_stream_request(request.query_params)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    if not lazy_modules.is_loaded():
+        await asyncio.to_thread(load_analysis_stack)
+
+    async def body():
+        subscription = _stream_hub.subscribe(symbol, timeframes)
+        try:
+            yield 'retry: 5000\n\n'
+            async for event in stream_events(subscription):
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    event_type, data = event
+                    yield f'event: {event_type}\ndata: {data}\n\n'
+        finally:
+            _stream_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        body(), media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def websocket_updates(websocket):
+    """WebSocket feed of live SMC deltas for one symbol"""
+    symbol, timeframes, error = parse_stream_request(websocket.query_params)
+    await websocket.accept()
+    if error:
+        await websocket.send_text(json.dumps({"event": "error", "error": error}))
+        await websocket.close(code=1008)
+        return
+    if not lazy_modules.is_loaded():
+        await asyncio.to_thread(load_analysis_stack)
+
+    async def watch_disconnect():
+        # Clients only listen; anything they send is ignored until they disconnect
+        with contextlib.suppress(WebSocketDisconnect):
+            while True:
+                await websocket.receive_text()
+
+    async def send_events():
+        with contextlib.suppress(WebSocketDisconnect):
+            async for event in stream_events(subscription):
+                if event is not None:
+                    event_type, data = event
+                    await websocket.send_text(f'{{"event": "{event_type}", "data": {data}}}')
+
+    subscription = _stream_hub.subscribe(symbol, timeframes)
+    tasks = [asyncio.create_task(watch_disconnect()), asyncio.create_task(send_events())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        _stream_hub.unsubscribe(subscription)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Warm up this worker and open its shared webhook client and stream hub"""
+    global _webhook_client, _stream_hub
+    await asyncio.to_thread(warm_up)
+    _webhook_client = httpx.AsyncClient()
+    _stream_hub = live_stream.StreamHub(live_stream.default_source(), perform_comprehensive_analysis)
+    try:
+        yield
+    finally:
+        _stream_hub.close()
+        await _webhook_client.aclose()
+        upstream.shutdown()
+        analysis_pool.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/chart-data', get_chart_data, methods=['POST']),
+        Route('/symbols', get_popular_symbols, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET']),
+        Route('/stream', stream_updates, methods=['GET']),
+        WebSocketRoute('/ws', websocket_updates)
+    ],
+    lifespan=lifespan
+)
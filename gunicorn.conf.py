@@ -0,0 +1,33 @@
+"""
+Gunicorn settings, picked up automatically from the working directory.
+
+The app is imported once in the master (preload_app) and, unless
+PRELOAD_ANALYSIS_STACK=0, the heavy analysis stack (pandas, numpy, yfinance,
+requests) is loaded there too, so forked workers share it copy-on-write
+instead of each importing it. Each worker then runs app.warm_up() before it
+accepts connections (synthetic analysis with ANALYSIS_WARMUP=1, analysis pool
+start with ANALYSIS_POOL_WARMUP=1). Unless ANALYSIS_POOL_SIZE is set, each
+worker's analysis pool gets its share of the CPUs, so --workers 2 on a
+4-CPU machine runs 2 analysis processes per worker rather than 4.
+
+Works for both app:app and asgi:app (-k uvicorn.workers.UvicornWorker).
+"""
+import os
+
+preload_app = True
+
+
+def on_starting(server):
+    """Master: runs after the app is preloaded, before any worker is forked"""
+    if 'ANALYSIS_POOL_SIZE' not in os.environ:
+        import analysis_pool
+        analysis_pool.POOL_SIZE = analysis_pool.default_pool_size(server.cfg.workers)
+    if os.environ.get('PRELOAD_ANALYSIS_STACK', '1') == '1':
+        import app
+        app.load_analysis_stack()
+
+
+def post_worker_init(worker):
+    """Worker: runs before the worker starts accepting connections"""
+    import app
+    app.warm_up()
@@ -0,0 +1,47 @@
+"""
+Deferred imports for the heavy analysis stack (pandas, numpy, yfinance, requests).
+
+`pd = lazy_import('pandas')` binds a module object whose real import runs on
+first attribute access, so /health and /symbols can be served before the
+analysis stack is loaded. Once loaded the object is the real module and
+attribute access costs nothing extra.
+"""
+import sys
+import threading
+import importlib.util
+
+ANALYSIS_STACK = ('numpy', 'pandas', 'requests', 'yfinance')
+
+_loaded = set()
+_lock = threading.Lock()
+
+
+def lazy_import(name):
+    """Return module `name`, deferring its execution until first use"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(names=ANALYSIS_STACK):
+    """Force the real import of every module in names; True if anything was imported"""
+    imported = False
+    with _lock:
+        for name in names:
+            if name not in _loaded:
+                # Any attribute access completes a lazy module's import
+                getattr(lazy_import(name), '__dict__')
+                _loaded.add(name)
+                imported = True
+    return imported
+
+
+def is_loaded(names=ANALYSIS_STACK):
+    """True once load() has imported every module in names"""
+    return all(name in _loaded for name in names)
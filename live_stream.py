@@ -0,0 +1,386 @@
+"""
+Live SMC updates pushed to subscribers over SSE / WebSocket (see asgi.py).
+
+One SymbolFeed per symbol polls its data source for the union of the
+timeframes its subscribers asked for, re-runs the analysis only when the
+bars changed, and publishes deltas per timeframe:
+
+    candles           new candles, plus the forming candle when it changed
+    order_blocks      {'added', 'removed', 'invalidated'}
+    fair_value_gaps   {'added', 'removed', 'invalidated'}
+    bias              overall/premium-discount bias, only when it changed
+
+A zone is invalidated once the latest close trades through it: a bullish
+order block below its low, a bearish one above its high, a bullish FVG back
+above its high and a bearish FVG back below its low. `removed` zones just
+dropped out of the detector's look-back window.
+
+Each event is serialized once and the same string is queued to every
+subscriber, so fan-out costs one put per subscriber. A subscriber whose
+queue overflows gets its backlog replaced by a fresh snapshot.
+
+Environment:
+    STREAM_SOURCE            "yfinance" (default) or "replay"
+    REPLAY_DATA_DIR          directory of <SYMBOL>_<timeframe>.csv files for the replay source
+    STREAM_POLL_INTERVAL     seconds between polls of a symbol (default: 15)
+    STREAM_ANALYSIS_PERIOD   history period analyzed per poll (default: 3mo)
+    STREAM_QUEUE_SIZE        events buffered per subscriber (default: 100)
+"""
+import os
+import json
+import asyncio
+import logging
+import analysis_pool
+import upstream
+from bars import Bars
+from lazy_modules import lazy_import
+
+pd = lazy_import('pandas')
+
+STREAM_SOURCE = os.environ.get('STREAM_SOURCE', 'yfinance')
+REPLAY_DATA_DIR = os.environ.get('REPLAY_DATA_DIR', 'replay_data')
+POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', 15))
+ANALYSIS_PERIOD = os.environ.get('STREAM_ANALYSIS_PERIOD', '3mo')
+QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 100))
+
+RESYNC = 'resync'
+
+
+class YFinanceSource:
+    """Live bars from yfinance, fetched in the scheduler's prefetch lane behind interactive requests"""
+
+    def __init__(self, period=ANALYSIS_PERIOD):
+        self.period = period
+
+    async def fetch(self, symbol, timeframe):
+        frame = await upstream.history_async(symbol, self.period, timeframe, lane=upstream.PREFETCH)
+        return Bars.from_frame(frame)
+
+
+class ReplaySource:
+    """
+    Replays recorded bars: every fetch of a (symbol, timeframe) reveals `step`
+    more bars, starting from the first `start` bars.
+    """
+
+    def __init__(self, series, start=100, step=1):
+        self.series = {key: (bars if isinstance(bars, Bars) else Bars.from_frame(bars)) for key, bars in series.items()}
+        self.start = start
+        self.step = step
+        self._cursors = {}
+
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        """Load <SYMBOL>_<timeframe>.csv files written with DataFrame.to_csv()"""
+        series = {}
+        for filename in os.listdir(path):
+            if not filename.endswith('.csv'):
+                continue
+            symbol, _, timeframe = filename[:-4].rpartition('_')
+            frame = pd.read_csv(os.path.join(path, filename), index_col=0)
+            frame.index = pd.to_datetime(frame.index, utc=True)
+            series[(symbol.upper(), timeframe)] = frame
+        return cls(series, **kwargs)
+
+    async def fetch(self, symbol, timeframe):
+        bars = self.series.get((symbol, timeframe))
+        if bars is None:
+            return Bars.empty()
+        cursor = self._cursors.get((symbol, timeframe), self.start)
+        self._cursors[(symbol, timeframe)] = min(cursor + self.step, len(bars))
+        return bars.head(cursor)
+
+
+def _zone_key(zone):
+    return f"{zone['type']}@{zone['timestamp']}"
+
+
+def _invalidated(zone, close):
+    """True once the close has traded through the zone (see module docstring)"""
+    if zone['type'] == 'bullish_ob':
+        return close < zone['low']
+    if zone['type'] == 'bearish_ob':
+        return close > zone['high']
+    if zone['type'] == 'bullish_fvg':
+        return close > zone['high']
+    return close < zone['low']
+
+
+def _diff_zones(previous, current, invalidated_keys, close):
+    """Delta of one zone list; previous maps key -> zone of zones still live for the client"""
+    live = {}
+    delta = {'added': [], 'removed': [], 'invalidated': []}
+    for zone in current:
+        key = _zone_key(zone)
+        if key in invalidated_keys:
+            continue
+        if _invalidated(zone, close):
+            invalidated_keys.add(key)
+            if key in previous:
+                delta['invalidated'].append(zone)
+            continue
+        live[key] = zone
+        if key not in previous:
+            delta['added'].append(zone)
+    for key, zone in previous.items():
+        if key in live or key in invalidated_keys:
+            continue
+        if _invalidated(zone, close):
+            invalidated_keys.add(key)
+            delta['invalidated'].append(zone)
+        else:
+            delta['removed'].append(zone)
+    return live, {name: zones for name, zones in delta.items() if zones}
+
+
+def _bias(analysis):
+    premium_discount = analysis['smart_money_concepts'].get('premium_discount') or {}
+    return {
+        'overall_bias': analysis['trading_signals']['overall_bias'],
+        'premium_discount': premium_discount.get('current_bias')
+    }
+
+
+def empty_state():
+    return {
+        'last_candle': None, 'order_blocks': {}, 'fair_value_gaps': {}, 'bias': None,
+        'invalidated': set(), 'analysis': None
+    }
+
+
+def diff_analysis(state, analysis):
+    """
+    Compare a fresh analysis with what subscribers already have.
+    Returns (delta, new_state); delta is empty when nothing changed.
+    """
+    close = analysis['current_price']
+    last_candle = state['last_candle']
+    candles = [
+        candle for candle in analysis['chart_data']
+        if last_candle is None or candle['timestamp'] > last_candle['timestamp']
+        or (candle['timestamp'] == last_candle['timestamp'] and candle != last_candle)
+    ]
+
+    invalidated = set(state['invalidated'])
+    smc = analysis['smart_money_concepts']
+    order_blocks, order_block_delta = _diff_zones(state['order_blocks'], smc['order_blocks'], invalidated, close)
+    fvgs, fvg_delta = _diff_zones(state['fair_value_gaps'], smc['fair_value_gaps'], invalidated, close)
+    bias = _bias(analysis)
+    # Only remember invalidations the detectors can still report
+    invalidated &= {_zone_key(zone) for zone in smc['order_blocks'] + smc['fair_value_gaps']}
+
+    delta = {}
+    if candles:
+        delta['candles'] = candles
+    if order_block_delta:
+        delta['order_blocks'] = order_block_delta
+    if fvg_delta:
+        delta['fair_value_gaps'] = fvg_delta
+    if bias != state['bias']:
+        delta['bias'] = bias
+    if delta:
+        delta['current_price'] = close
+
+    new_state = {
+        'last_candle': analysis['chart_data'][-1] if analysis['chart_data'] else last_candle,
+        'order_blocks': order_blocks, 'fair_value_gaps': fvgs, 'bias': bias,
+        'invalidated': invalidated, 'analysis': analysis
+    }
+    return delta, new_state
+
+
+def snapshot(symbol, timeframe, state):
+    """Full current view of one timeframe for a (re)joining subscriber"""
+    analysis = state['analysis']
+    return {
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'current_price': analysis['current_price'],
+        'candles': analysis['chart_data'],
+        'order_blocks': list(state['order_blocks'].values()),
+        'fair_value_gaps': list(state['fair_value_gaps'].values()),
+        'bias': state['bias']
+    }
+
+
+def encode(payload):
+    return json.dumps(payload, default=str)
+
+
+class Subscription:
+    """One client's bounded event queue for a symbol and set of timeframes"""
+
+    def __init__(self, symbol, timeframes, queue_size=QUEUE_SIZE):
+        self.symbol = symbol
+        self.timeframes = set(timeframes)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.resync_pending = False
+
+    def push(self, event_type, data):
+        if self.resync_pending:
+            # The snapshot sent on resync will already include this event
+            return
+        try:
+            self.queue.put_nowait((event_type, data))
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog, it will be sent a fresh snapshot instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((RESYNC, None))
+            self.resync_pending = True
+
+    async def next_event(self, timeout=None):
+        """Next (event_type, json) pair, or None if nothing arrived within timeout"""
+        try:
+            if self.queue.empty():
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+            else:
+                event = self.queue.get_nowait()
+        except asyncio.TimeoutError:
+            return None
+        if event[0] == RESYNC:
+            self.resync_pending = False
+        return event
+
+
+class SymbolFeed:
+    """Shared poll loop for one symbol, however many clients subscribe to it"""
+
+    def __init__(self, symbol, source, analyze, poll_interval=POLL_INTERVAL):
+        self.symbol = symbol
+        self.source = source
+        self.analyze = analyze
+        self.poll_interval = poll_interval
+        self.subscribers = set()
+        self.states = {}
+        self._signatures = {}
+        self._task = None
+
+    def timeframes(self):
+        return set().union(*(sub.timeframes for sub in self.subscribers)) if self.subscribers else set()
+
+    def add(self, subscription):
+        self.subscribers.add(subscription)
+        for event_type, data in self.snapshot_events(subscription.timeframes):
+            subscription.push(event_type, data)
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def remove(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.forget_unwatched()
+
+    def forget_unwatched(self):
+        """Drop state for timeframes no subscriber covers, so a later subscriber starts from a fresh snapshot"""
+        watched = self.timeframes()
+        for tf in (set(self.states) | set(self._signatures)) - watched:
+            self.states.pop(tf, None)
+            self._signatures.pop(tf, None)
+
+    def snapshot_events(self, timeframes):
+        return [
+            ('snapshot', encode(snapshot(self.symbol, tf, self.states[tf])))
+            for tf in sorted(timeframes) if tf in self.states
+        ]
+
+    def publish(self, timeframe, event_type, data):
+        for subscription in list(self.subscribers):
+            if timeframe in subscription.timeframes:
+                subscription.push(event_type, data)
+
+    async def tick(self):
+        """Fetch every subscribed timeframe once and publish what changed"""
+        timeframes = sorted(self.timeframes())
+        # Concurrently, so one slow or failing timeframe neither delays nor aborts the others
+        fetched = await asyncio.gather(*(self.source.fetch(self.symbol, tf) for tf in timeframes), return_exceptions=True)
+        jobs = []
+        signatures = {}
+        for tf, bars in zip(timeframes, fetched):
+            if isinstance(bars, BaseException):
+                logging.error(f"Stream fetch failed for {self.symbol} {tf}: {str(bars)}")
+                continue
+            if len(bars) == 0:
+                continue
+            # Skip the analysis when neither a new bar nor a changed forming bar arrived
+            signature = (len(bars), int(bars.timestamps[-1]), float(bars.close[-1]), int(bars.volume[-1]))
+            if self._signatures.get(tf) == signature:
+                continue
+            signatures[tf] = signature
+            jobs.append((bars, tf, self.symbol))
+        if not jobs:
+            return
+
+        results = await analysis_pool.run_analyses_async(jobs, self.analyze)
+        watched = self.timeframes()
+        for (_, tf, _), analysis in zip(jobs, results):
+            if tf not in watched:
+                # Its last subscriber left while the analysis ran
+                continue
+            if 'error' in analysis:
+                logging.error(f"Stream analysis failed for {self.symbol} {tf}: {analysis['error']}")
+                continue
+            first = tf not in self.states
+            delta, self.states[tf] = diff_analysis(self.states.get(tf, empty_state()), analysis)
+            # Only an analysed signature is skipped next time; a failed one is retried
+            self._signatures[tf] = signatures[tf]
+            if first:
+                self.publish(tf, 'snapshot', encode(snapshot(self.symbol, tf, self.states[tf])))
+            elif delta:
+                self.publish(tf, 'update', encode(dict(delta, symbol=self.symbol, timeframe=tf)))
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Stream poll failed for {self.symbol}: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+
+class StreamHub:
+    """Registry of SymbolFeeds; feeds start with their first subscriber and stop with their last"""
+
+    def __init__(self, source, analyze, poll_interval=POLL_INTERVAL):
+        self.source = source
+        self.analyze = analyze
+        self.poll_interval = poll_interval
+        self.feeds = {}
+
+    def subscribe(self, symbol, timeframes):
+        feed = self.feeds.get(symbol)
+        if feed is None:
+            feed = self.feeds[symbol] = SymbolFeed(symbol, self.source, self.analyze, self.poll_interval)
+        subscription = Subscription(symbol, timeframes)
+        feed.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        feed = self.feeds.get(subscription.symbol)
+        if feed is None:
+            return
+        feed.remove(subscription)
+        if not feed.subscribers:
+            del self.feeds[subscription.symbol]
+
+    def resync_events(self, subscription):
+        """Snapshot events replacing a dropped backlog"""
+        feed = self.feeds.get(subscription.symbol)
+        return feed.snapshot_events(subscription.timeframes) if feed is not None else []
+
+    def close(self):
+        for feed in self.feeds.values():
+            if feed._task is not None:
+                feed._task.cancel()
+        self.feeds.clear()
+
+
+def default_source():
+    """Data source selected by STREAM_SOURCE"""
+    if STREAM_SOURCE == 'replay':
+        return ReplaySource.from_directory(REPLAY_DATA_DIR)
+    return YFinanceSource()
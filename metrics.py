@@ -0,0 +1,277 @@
+"""
+Per-stage timing instrumentation for the analysis pipeline.
+
+Stages are timed with `with metrics.stage('fetch', timeframe):`. Every timing
+is aggregated into process-wide latency histograms (exposed in Prometheus
+text format on /metrics) and, while a request is being handled, appended to
+that request's Profile so it can be returned with ?profile=1. Cache lookups
+are counted with record_cache(); the /chart-data result cache reports under
+cache="result".
+
+Metrics are per process: with several gunicorn workers each worker reports
+its own series.
+"""
+import time
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_profile = contextvars.ContextVar('smc_request_profile', default=None)
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram keyed by a single label"""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {series["count"]}')
+        return lines
+
+
+class CacheStats:
+    """Hit/miss counters per named cache, rendered with a derived hit ratio"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, cache, hit):
+        with self._lock:
+            counts = self._counts.setdefault(cache, {'hit': 0, 'miss': 0})
+            counts['hit' if hit else 'miss'] += 1
+
+    def render(self):
+        lines = [
+            "# HELP smc_cache_requests_total Cache lookups by result",
+            "# TYPE smc_cache_requests_total counter"
+        ]
+        ratios = [
+            "# HELP smc_cache_hit_ratio Fraction of cache lookups that were hits",
+            "# TYPE smc_cache_hit_ratio gauge"
+        ]
+        with self._lock:
+            for cache, counts in sorted(self._counts.items()):
+                total = counts['hit'] + counts['miss']
+                lines.append(f'smc_cache_requests_total{{cache="{cache}",result="hit"}} {counts["hit"]}')
+                lines.append(f'smc_cache_requests_total{{cache="{cache}",result="miss"}} {counts["miss"]}')
+                ratios.append(f'smc_cache_hit_ratio{{cache="{cache}"}} {counts["hit"] / total if total else 0:.6f}')
+        return lines + ratios
+
+
+class StartupTimes:
+    """Seconds spent in each startup phase of this process"""
+
+    def __init__(self):
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self._phases[phase] = seconds
+
+    def render(self):
+        lines = [
+            "# HELP smc_startup_seconds Time spent in each startup phase of this process",
+            "# TYPE smc_startup_seconds gauge"
+        ]
+        with self._lock:
+            for phase, seconds in sorted(self._phases.items()):
+                lines.append(f'smc_startup_seconds{{phase="{phase}"}} {seconds:.6f}')
+        return lines
+
+
+class UpstreamStats:
+    """Counters of upstream calls by kind and outcome, and of requests served by a shared call"""
+
+    def __init__(self):
+        self._calls = {}
+        self._shared = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, result, requests=1):
+        with self._lock:
+            self._calls[(kind, result)] = self._calls.get((kind, result), 0) + 1
+            self._shared += requests - 1
+
+    def render(self):
+        lines = [
+            "# HELP smc_upstream_calls_total Upstream calls by kind and outcome",
+            "# TYPE smc_upstream_calls_total counter"
+        ]
+        with self._lock:
+            for (kind, result), count in sorted(self._calls.items()):
+                lines.append(f'smc_upstream_calls_total{{kind="{kind}",result="{result}"}} {count}')
+            lines += [
+                "# HELP smc_upstream_coalesced_total Requests answered by another request's upstream call",
+                "# TYPE smc_upstream_coalesced_total counter",
+                f"smc_upstream_coalesced_total {self._shared}"
+            ]
+        return lines
+
+
+REQUEST_SECONDS = Histogram('smc_request_duration_seconds', 'End-to-end request latency', 'endpoint')
+STAGE_SECONDS = Histogram('smc_stage_duration_seconds', 'Latency of each analysis pipeline stage', 'stage')
+UPSTREAM_WAIT_SECONDS = Histogram('smc_upstream_queue_seconds', 'Time upstream requests wait in the scheduler', 'lane')
+UPSTREAM_STATS = UpstreamStats()
+CACHE_STATS = CacheStats()
+STARTUP_TIMES = StartupTimes()
+
+
+class Profile:
+    """Stage timings collected for one request (or one pool job)"""
+
+    def __init__(self, observe=True):
+        self.started = time.perf_counter()
+        self.observe = observe
+        self.stages = []
+
+    def add(self, name, timeframe, seconds):
+        self.stages.append((name, timeframe, seconds))
+
+    def summary(self):
+        stages = []
+        for name, timeframe, seconds in self.stages:
+            entry = {'stage': name, 'ms': round(seconds * 1000, 3)}
+            if timeframe is not None:
+                entry['timeframe'] = timeframe
+            stages.append(entry)
+        return {'total_ms': round((time.perf_counter() - self.started) * 1000, 3), 'stages': stages}
+
+
+def current_profile():
+    """Profile of the request being handled, or None outside a request"""
+    return _current_profile.get()
+
+
+def record_stage(name, seconds, timeframe=None):
+    """Record one stage timing in the histograms and the current request profile"""
+    profile = _current_profile.get()
+    if profile is None or profile.observe:
+        STAGE_SECONDS.observe(seconds, name)
+    if profile is not None:
+        profile.add(name, timeframe, seconds)
+
+
+@contextlib.contextmanager
+def stage(name, timeframe=None):
+    """Time the enclosed block as pipeline stage `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start, timeframe)
+
+
+@contextlib.contextmanager
+def collect_stages():
+    """
+    Collect stage timings without observing them, for code running in a pool
+    worker; the parent passes the result to replay_stages().
+    """
+    profile = Profile(observe=False)
+    token = _current_profile.set(profile)
+    try:
+        yield profile.stages
+    finally:
+        _current_profile.reset(token)
+
+
+def replay_stages(stages):
+    """Record timings collected by collect_stages() in this process"""
+    for name, timeframe, seconds in stages:
+        record_stage(name, seconds, timeframe)
+
+
+def record_startup(phase, seconds):
+    """Record how long startup phase `phase` took in this process"""
+    STARTUP_TIMES.record(phase, seconds)
+
+
+@contextlib.contextmanager
+def startup_phase(phase):
+    """Time the enclosed block as startup phase `phase`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(phase, time.perf_counter() - start)
+
+
+def record_upstream(kind, result, requests=1):
+    """Count one upstream call that answered `requests` scheduled requests"""
+    UPSTREAM_STATS.record(kind, result, requests)
+
+
+def record_cache(cache, hit):
+    """Count a hit or miss on the named cache"""
+    CACHE_STATS.record(cache, hit)
+
+
+@contextlib.contextmanager
+def request_profile(endpoint):
+    """Give the enclosed request handling its own Profile and time it end to end"""
+    profile = Profile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        REQUEST_SECONDS.observe(time.perf_counter() - profile.started, endpoint)
+
+
+def instrument(endpoint):
+    """Decorator wrapping a (sync or async) view in request_profile(endpoint)"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with request_profile(endpoint):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with request_profile(endpoint):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_prometheus():
+    """All metrics in Prometheus text exposition format"""
+    lines = (
+        REQUEST_SECONDS.render() + STAGE_SECONDS.render() + CACHE_STATS.render() + STARTUP_TIMES.render()
+        + UPSTREAM_WAIT_SECONDS.render() + UPSTREAM_STATS.render()
+    )
+    return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,169 @@
+"""
+Content-addressed cache of full /chart-data results.
+
+Results are keyed by the normalized request (symbol, timeframes, period and
+any other analysis options) plus the timestamp of the last bar of every
+timeframe, so a poll that arrives before a new bar has opened is served from
+memory without re-running the analysis. Each entry keeps its serialized body
+together with gzip (and, when the optional `zstandard` package is installed,
+zstd) compressed copies and an ETag, so repeat hits and conditional
+requests (If-None-Match -> 304) cost no analysis, serialization or
+compression. The ETag hashes the result without its fetch time, so every
+worker (and a cache refilled after expiry) tags identical data identically.
+Bodies carrying the same data can still differ in bytes (fetched_at, key
+order), so the tag is weak: it promises the same data, not the same bytes.
+
+Environment:
+    RESULT_CACHE_SIZE  max cached results per process (default: 256, 0 = disabled)
+    RESULT_CACHE_TTL   seconds an entry stays fresh even if no new bar has opened,
+                       bounding how stale the forming bar can get (default: 60, 0 = no limit)
+"""
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 60))
+
+# Preferred first when the client accepts several
+ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+# Response fields that change on every computation without the data changing
+VOLATILE_FIELDS = ('fetched_at',)
+
+
+def content_digest(data):
+    """Hash of a result's content, ignoring VOLATILE_FIELDS and independent of serializer settings"""
+    stable = {name: value for name, value in data.items() if name not in VOLATILE_FIELDS}
+    material = json.dumps(stable, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]
+
+
+class CacheEntry:
+    """One cached result: the response data, its encoded bodies and ETag"""
+
+    def __init__(self, data, body):
+        self.data = data
+        self.created = time.monotonic()
+        self.digest = content_digest(data)
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+        if zstandard is not None:
+            self.bodies['zstd'] = zstandard.ZstdCompressor(level=3).compress(body)
+
+    @property
+    def body(self):
+        return self.bodies['identity']
+
+    def etag(self, encoding='identity'):
+        """Weak ETag (same data, not necessarily the same bytes), suffixed with the content-coding"""
+        suffix = '' if encoding == 'identity' else f'-{encoding}'
+        return f'W/"{self.digest}{suffix}"'
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header value refers to this entry (any encoding)"""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            if tag.split('-', 1)[0] == self.digest:
+                return True
+        return False
+
+    def negotiate(self, accept_encoding):
+        """Pick the best precompressed body for an Accept-Encoding header; returns (encoding, body)"""
+        accepted = set()
+        for part in (accept_encoding or '').split(','):
+            name, *params = part.split(';')
+            quality = 1.0
+            for param in params:
+                field, _, value = param.strip().partition('=')
+                if field == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ENCODINGS:
+            if encoding in accepted:
+                return encoding, self.bodies[encoding]
+        return 'identity', self.body
+
+
+class ResultCache:
+    """Thread-safe LRU of CacheEntry objects with an optional freshness limit"""
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, data, body):
+        entry = CacheEntry(data, body)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def cache_key(params, histories):
+    """
+    Content address of a /chart-data result: the request parameters that shape
+    the analysis plus the last bar timestamp of every requested timeframe
+    (histories maps timeframe -> Bars).
+    """
+    last_bars = {
+        tf: (int(bars.timestamps[-1]) if len(bars) else None)
+        for tf, bars in histories.items()
+    }
+    options = {name: value for name, value in params.items() if name != 'callback_url'}
+    material = json.dumps({'request': options, 'last_bars': last_bars}, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def cache_headers(entry, encoding, hit):
+    """Response headers for a body served from (or just stored in) the cache"""
+    headers = {
+        'ETag': entry.etag(encoding),
+        'Vary': 'Accept-Encoding',
+        'Cache-Control': 'no-cache',
+        'X-Cache': 'hit' if hit else 'miss'
+    }
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return headers
+
+
+results = ResultCache()
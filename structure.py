@@ -0,0 +1,260 @@
+"""
+Market structure engine: swing labels (HH/HL/LH/LL), break of structure (BOS)
+and change of character (ChoCH) at internal and swing scale.
+
+A swing high at bar p is the highest high of the 2 * window + 1 bars around
+it, so it is only known once bar p + window has closed; from then on it is
+the level the structure watches. A close crossing above the watched swing
+high is a bullish break: a ChoCH when the trend was bearish, a BOS
+otherwise, and the trend becomes bullish. Swing lows mirror this. Each level
+breaks at most once and is replaced by the next confirmed swing.
+
+Two engines run side by side: internal structure (window 5, the swings
+detect_swing_points reports) and swing structure (window 20). An internal
+break of the very level the swing structure is watching is left to the
+swing structure, so the same break is not reported twice.
+
+StructureEngine.update(bars) only processes bars it has not seen, so the
+same state machine serves a one-off analysis and a live series that grows a
+bar at a time (feed it closed bars only; a forming bar can still change).
+Each update is O(new bars) NumPy work, plus a Python step per break:
+watched levels are laid out per bar with np.repeat, the first crossing of
+each level is found with np.searchsorted, and only the breaks themselves go
+through the trend state machine. `python structure.py` benchmarks it.
+"""
+import time
+from lazy_modules import lazy_import
+from bars import Bars, as_price
+
+np = lazy_import('numpy')
+
+INTERNAL_WINDOW = 5
+SWING_WINDOW = 20
+
+BULLISH, NEUTRAL, BEARISH = 1, 0, -1
+TREND_NAMES = {BULLISH: 'bullish', NEUTRAL: 'neutral', BEARISH: 'bearish'}
+
+
+def swing_point_positions(bars, window=5):
+    """Positions of swing highs and lows: bars holding the extreme of the 2 * window + 1 bars around them"""
+    n = len(bars)
+    if n < 2 * window + 1:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    span = 2 * window + 1
+    centers = np.arange(window, n - window)
+    window_highs = np.lib.stride_tricks.sliding_window_view(bars.high, span).max(axis=1)
+    window_lows = np.lib.stride_tricks.sliding_window_view(bars.low, span).min(axis=1)
+
+    high_positions = centers[bars.high[window:n - window] >= window_highs]
+    low_positions = centers[bars.low[window:n - window] <= window_lows]
+    return high_positions, low_positions
+
+
+class _Level:
+    """The swing one side of the structure is watching"""
+
+    __slots__ = ('price', 'position', 'crossed')
+
+    def __init__(self):
+        self.price = np.nan
+        self.position = -1
+        self.crossed = True
+
+
+class StructureEngine:
+    """Trend state machine for one swing window, advanced with update(bars)"""
+
+    def __init__(self, window):
+        self.window = window
+        self.trend = NEUTRAL
+        self.processed = 0
+        self.top = _Level()
+        self.bottom = _Level()
+        # Swing labels, as bar positions
+        self.higher_highs, self.lower_highs = [], []
+        self.higher_lows, self.lower_lows = [], []
+        # Breaks, as (break position, direction, 'bos' | 'choch', swing position, level)
+        self.breaks = []
+
+    def update(self, bars, guard=None):
+        """
+        Advance over bars[processed:]; bars must extend the series seen so far.
+        guard optionally maps 'top'/'bottom' to per-bar levels (for the new bars)
+        whose crossings are ignored. Returns this engine's per-bar watched levels
+        for the new bars, as guard arrays for a finer engine.
+        """
+        n = len(bars)
+        start = self.processed
+        if n <= start:
+            empty = np.empty(0)
+            return {'top': empty, 'bottom': empty}
+
+        # Swings confirmed by the new bars: centers from start - window on
+        window = self.window
+        offset = max(start - 2 * window, 0)
+        high_positions, low_positions = swing_point_positions(bars.slice(offset, n), window)
+        high_positions = high_positions[high_positions + offset + window >= start] + offset
+        low_positions = low_positions[low_positions + offset + window >= start] + offset
+
+        self._label(high_positions, bars.high, self.top, self.higher_highs, self.lower_highs)
+        self._label(low_positions, bars.low, self.bottom, self.higher_lows, self.lower_lows)
+
+        close = bars.close[start:n].astype(np.float64)
+        previous_close = bars.close[start - 1:n - 1].astype(np.float64) if start else np.concatenate(([np.nan], close[:-1]))
+        guard = guard or {}
+        top_breaks, top_levels = self._crossings(
+            high_positions, bars.high, self.top, start, n, close, previous_close, BULLISH, guard.get('top')
+        )
+        bottom_breaks, bottom_levels = self._crossings(
+            low_positions, bars.low, self.bottom, start, n, close, previous_close, BEARISH, guard.get('bottom')
+        )
+
+        # Only the breaks go through the trend state machine, in bar order (tops first on a tie)
+        for position, direction, swing_position, level in sorted(top_breaks + bottom_breaks, key=lambda item: item[0]):
+            tag = 'choch' if self.trend == -direction else 'bos'
+            self.trend = direction
+            self.breaks.append((position, direction, tag, swing_position, level))
+
+        self.processed = n
+        return {'top': top_levels, 'bottom': bottom_levels}
+
+    def _label(self, positions, prices, level, higher, lower):
+        """HH/LH (or HL/LL) labels against the previous swing on the same side"""
+        if not len(positions):
+            return
+        swing_prices = prices[positions].astype(np.float64)
+        previous = np.concatenate(([level.price if level.position >= 0 else np.nan], swing_prices[:-1]))
+        higher.extend(positions[swing_prices > previous].tolist())
+        lower.extend(positions[swing_prices < previous].tolist())
+
+    def _crossings(self, positions, prices, level, start, n, close, previous_close, direction, guard):
+        """First crossing of each watched level over bars start:n; returns (breaks, per-bar levels)"""
+        # Segment k starts when swing k is confirmed and lasts until the next one; segment 0 carries the current level
+        starts = np.concatenate(([0], positions + self.window - start))
+        lengths = np.diff(np.append(starts, n - start))
+        swing_prices = prices[positions].astype(np.float64)
+        current = np.repeat(np.concatenate(([level.price], swing_prices)), lengths)
+        watched = np.concatenate(([np.nan if level.crossed else level.price], swing_prices))
+        levels_at = np.repeat(watched, lengths)
+
+        if direction == BULLISH:
+            crossed = (close > levels_at) & ~(previous_close > levels_at)
+        else:
+            crossed = (close < levels_at) & ~(previous_close < levels_at)
+        if guard is not None:
+            crossed &= levels_at != guard
+        hits = np.flatnonzero(crossed)
+
+        # First hit at or after each segment start, kept if it falls before the segment ends
+        first = np.searchsorted(hits, starts)
+        found = first < len(hits)
+        first_hit = np.where(found, hits[np.minimum(first, len(hits) - 1)] if len(hits) else 0, n - start)
+        broken = found & (first_hit < starts + lengths)
+
+        segment_positions = np.concatenate(([level.position], positions))
+        segment_levels = np.concatenate(([level.price], swing_prices))
+        breaks = [
+            (int(first_hit[k]) + start, direction, int(segment_positions[k]), float(segment_levels[k]))
+            for k in np.flatnonzero(broken)
+        ]
+
+        level.price = float(segment_levels[-1])
+        level.position = int(segment_positions[-1])
+        level.crossed = bool(broken[-1]) or (len(starts) == 1 and level.crossed)
+        return breaks, current
+
+
+class MarketStructure:
+    """Internal and swing StructureEngines over one series"""
+
+    def __init__(self, internal_window=INTERNAL_WINDOW, swing_window=SWING_WINDOW):
+        self.internal = StructureEngine(internal_window)
+        self.swing = StructureEngine(swing_window)
+
+    def update(self, bars):
+        """Process the bars appended since the last update"""
+        guard = self.swing.update(bars)
+        self.internal.update(bars, guard)
+        return self
+
+    def to_dict(self, bars):
+        """API representation; bars is the series last passed to update()"""
+        internal, swing = self.internal, self.swing
+        swing_lists = {
+            'higher_highs': (internal.higher_highs, bars.high, 'swing_high'),
+            'lower_highs': (internal.lower_highs, bars.high, 'swing_high'),
+            'higher_lows': (internal.higher_lows, bars.low, 'swing_low'),
+            'lower_lows': (internal.lower_lows, bars.low, 'swing_low')
+        }
+        break_lists = {
+            'internal_bos': [item for item in internal.breaks if item[2] == 'bos'],
+            'internal_choch': [item for item in internal.breaks if item[2] == 'choch'],
+            'swing_bos': [item for item in swing.breaks if item[2] == 'bos'],
+            'change_of_character': [item for item in swing.breaks if item[2] == 'choch']
+        }
+
+        # One timestamp formatting pass for every position referenced
+        positions = [position for items, _, _ in swing_lists.values() for position in items]
+        positions += [position for items in break_lists.values() for item in items for position in (item[0], item[3])]
+        times = dict(zip(positions, bars.format_times(np.asarray(positions, dtype=np.int64)))) if positions else {}
+
+        structure = {}
+        for name, (items, prices, point_type) in swing_lists.items():
+            structure[name] = [
+                {'index': position, 'price': as_price(prices[position]), 'timestamp': times[position], 'type': point_type}
+                for position in items
+            ]
+        for name, items in break_lists.items():
+            structure[name] = [
+                {
+                    'type': f"{'bullish' if direction == BULLISH else 'bearish'}_{tag}",
+                    'price': as_price(bars.high[swing_position] if direction == BULLISH else bars.low[swing_position]),
+                    'index': position, 'timestamp': times[position],
+                    'swing_index': swing_position, 'swing_timestamp': times[swing_position]
+                }
+                for position, direction, tag, swing_position, _ in items
+            ]
+        structure['trend'] = {'internal': TREND_NAMES[internal.trend], 'swing': TREND_NAMES[swing.trend]}
+        return structure
+
+
+def _random_walk(rows, seed=7):
+    """Synthetic Bars for the benchmark"""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, rows))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.3, rows))
+    return Bars(
+        timestamps=np.arange(rows, dtype=np.int64) * 60 + 1_700_000_000,
+        open=open_.astype(np.float32),
+        high=(np.maximum(open_, close) + spread).astype(np.float32),
+        low=(np.minimum(open_, close) - spread).astype(np.float32),
+        close=close.astype(np.float32),
+        volume=rng.integers(1_000, 100_000, rows)
+    )
+
+
+if __name__ == '__main__':
+    rows = 1_000_000
+    bars = _random_walk(rows)
+
+    started = time.perf_counter()
+    batch = MarketStructure().update(bars)
+    elapsed = time.perf_counter() - started
+    print(f"Batch: {rows:,} bars in {elapsed:.3f}s ({elapsed / rows * 1e9:.0f} ns/bar), "
+          f"{len(batch.internal.breaks):,} internal and {len(batch.swing.breaks):,} swing breaks")
+
+    tail = 10_000
+    incremental = MarketStructure().update(bars.head(rows - tail))
+    started = time.perf_counter()
+    for stop in range(rows - tail + 1, rows + 1):
+        incremental.update(bars.head(stop))
+    elapsed = time.perf_counter() - started
+    print(f"Incremental: {tail:,} single-bar updates in {elapsed:.3f}s ({elapsed / tail * 1e6:.0f} us/bar)")
+    assert incremental.internal.breaks == batch.internal.breaks and incremental.swing.breaks == batch.swing.breaks
+
+    started = time.perf_counter()
+    structure = batch.to_dict(bars)
+    print(f"to_dict: {time.perf_counter() - started:.3f}s")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared-memory analysis pool (analysis_pool.py).
+Needs no network: bars are synthetic.
+"""
+import os
+import asyncio
+import multiprocessing
+import numpy as np
+import analysis_pool
+from bars import Bars
+
+PARENT_PID = os.getpid()
+STATE = {'set_at_runtime': False}  # a forked worker would inherit the parent's runtime value
+
+
+def summarize(bars, timeframe, symbol):
+    """Module-level analyze function, so the pool can pickle it"""
+    return {'symbol': symbol, 'timeframe': timeframe, 'rows': len(bars), 'close': float(bars.close[-1]), 'pid': os.getpid()}
+
+
+def crash_in_worker(bars, timeframe, symbol):
+    """Kills a pool worker; runs normally when called inline in the parent"""
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return summarize(bars, timeframe, symbol)
+
+
+def inherited_state():
+    return STATE['set_at_runtime']
+
+
+def with_pool(size):
+    """Context for running with a pool of `size` workers regardless of ANALYSIS_POOL_SIZE"""
+    class PoolSize:
+        def __enter__(self):
+            self.original = analysis_pool.POOL_SIZE
+            analysis_pool.POOL_SIZE = size
+
+        def __exit__(self, *exc):
+            analysis_pool.shutdown()
+            analysis_pool.POOL_SIZE = self.original
+    return PoolSize()
+
+
+def test_shared_memory_round_trip():
+    """share_bars/attach_bars keep dtype, timezone and large volumes"""
+    print("🔍 Testing shared memory round trip...")
+    frame = analysis_pool.synthetic_ohlcv(50)
+    frame.index = frame.index.tz_convert('America/New_York')
+    frame['Volume'] = 5_000_000_000.0  # overflows int32
+    cheap = Bars.from_frame(frame)
+    frame[['Open', 'High', 'Low', 'Close']] *= 2000  # above FLOAT32_PRICE_LIMIT
+    expensive = Bars.from_frame(frame)
+
+    for bars, dtype in ((cheap, np.float32), (expensive, np.float64)):
+        shm, descriptor = analysis_pool.share_bars(bars)
+        try:
+            copy = analysis_pool.attach_bars(descriptor)
+        finally:
+            shm.close()
+            shm.unlink()
+        assert copy.close.dtype == dtype and copy.tz == 'America/New_York'
+        for field in ('timestamps', 'open', 'high', 'low', 'close', 'volume'):
+            assert np.array_equal(getattr(copy, field), getattr(bars, field)), field
+        assert copy.volume.dtype == np.int64 and copy.volume[0] == 5_000_000_000
+        print(f"✅ {np.dtype(dtype).name} bars round-trip intact")
+
+
+def test_pool_runs_given_analyze():
+    """The pool runs the analyze function it is given, like the inline path"""
+    print("\n🔍 Testing analyze pass-through...")
+    bars = Bars.from_frame(analysis_pool.synthetic_ohlcv(100))
+    jobs = [(bars, '1h', 'TEST'), (bars.head(60), '4h', 'TEST')]
+    inline = [summarize(*job) for job in jobs]
+    with with_pool(2):
+        pooled = analysis_pool.run_analyses(jobs, summarize)
+        pooled_async = asyncio.run(analysis_pool.run_analyses_async(jobs, summarize))
+    for results in (pooled, pooled_async):
+        assert all(result['pid'] != PARENT_PID for result in results)
+        assert [dict(result, pid=None) for result in results] == [dict(result, pid=None) for result in inline]
+    print("✅ Pool and inline results match")
+
+
+def test_pool_start_method_and_size():
+    """Workers never fork the (multithreaded) app process; the default size leaves 1-CPU hosts inline"""
+    print("\n🔍 Testing pool start method and default size...")
+    STATE['set_at_runtime'] = True
+    try:
+        with with_pool(1):
+            assert analysis_pool.get_executor().submit(inherited_state).result(30) is False
+    finally:
+        STATE['set_at_runtime'] = False
+    method = analysis_pool._mp_context().get_start_method()
+    assert method in ('forkserver', 'spawn'), method
+
+    cpus = os.cpu_count() or 1
+    assert analysis_pool.default_pool_size(1) == (cpus if cpus >= 2 else 0)
+    assert analysis_pool.default_pool_size(cpus) == 0
+    print(f"✅ {method} workers start without the parent's state; {cpus} CPU(s) give {analysis_pool.default_pool_size()} workers per app process")
+
+
+def test_broken_pool_falls_back_inline():
+    """A worker dying mid-job breaks the pool; the jobs are rerun inline"""
+    print("\n🔍 Testing broken pool fallback...")
+    bars = Bars.from_frame(analysis_pool.synthetic_ohlcv(100))
+    jobs = [(bars, '1h', 'TEST')]
+    with with_pool(1):
+        results = analysis_pool.run_analyses(jobs, crash_in_worker)
+        assert results[0]['pid'] == PARENT_PID
+        results = asyncio.run(analysis_pool.run_analyses_async(jobs, crash_in_worker))
+        assert results[0]['pid'] == PARENT_PID
+    print("✅ Broken pool fell back to inline analysis")
+
+
+if __name__ == "__main__":
+    print("🚀 Analysis Pool Test")
+    print("=" * 50)
+    test_shared_memory_round_trip()
+    test_pool_runs_given_analyze()
+    test_pool_start_method_and_size()
+    test_broken_pool_falls_back_inline()
+    print("\n🎉 Testing completed!")
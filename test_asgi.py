@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for the ASGI app (asgi.py) against the local upstream stub from test_upstream.py.
+Checks /chart-data parity with the Flask app, bad input and webhook failure handling.
+"""
+import os
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import upstream
+import result_cache
+from test_upstream import start_stub, StubUpstream
+
+CLOSED_PORT_URL = "http://127.0.0.1:9/webhook"  # discard port, nothing listens there
+
+
+class StubbedUpstream:
+    """Route upstream calls to the stub server and use a fresh result cache (disabled by default) for the duration"""
+
+    def __init__(self, cache_entries=0):
+        self.cache_entries = cache_entries
+
+    def __enter__(self):
+        self.server, backend = start_stub()
+        self.original = upstream._scheduler, upstream._scheduler_pid, result_cache.results
+        self.scheduler = upstream.UpstreamScheduler(backend, rate=0)
+        self.install()
+        result_cache.results = result_cache.ResultCache(max_entries=self.cache_entries)
+        return self
+
+    def install(self):
+        """(Re)install the stub scheduler; the ASGI lifespan shuts the module scheduler down on exit"""
+        upstream._scheduler, upstream._scheduler_pid = self.scheduler, os.getpid()
+
+    def __exit__(self, *exc):
+        self.scheduler.shutdown()
+        upstream._scheduler, upstream._scheduler_pid, result_cache.results = self.original
+        self.server.shutdown()
+
+
+def without_fetch_time(payload):
+    return {name: value for name, value in payload.items() if name != 'fetched_at'}
+
+
+def test_chart_data_parity():
+    """ASGI /chart-data returns the same analysis as the Flask app"""
+    from starlette.testclient import TestClient
+    import asgi
+    from app import app
+
+    print("🔍 Testing /chart-data parity with Flask...")
+    payload = {'symbol': 'aapl', 'timeframes': ['1d', '1h'], 'analysis_period': '1mo'}
+    with StubbedUpstream() as stub:
+        flask_response = app.test_client().post('/chart-data', json=payload)
+        stub.install()
+        with TestClient(asgi.app) as client:
+            asgi_response = client.post('/chart-data', json=payload)
+        calls = len(StubUpstream.calls)
+    assert flask_response.status_code == asgi_response.status_code == 200
+    assert without_fetch_time(asgi_response.json()) == without_fetch_time(flask_response.get_json())
+    assert asgi_response.json()['company_name'] == 'AAPL Inc.'
+    assert calls == 6  # 2 timeframes + info, per app
+    print(f"✅ Identical payloads for {payload['timeframes']}")
+
+
+def test_chart_data_errors():
+    """400 on missing or malformed JSON, 207 with the data when the webhook fails"""
+    from starlette.testclient import TestClient
+    import asgi
+    from app import app
+
+    print("\n🔍 Testing /chart-data error handling...")
+    with StubbedUpstream():
+        with TestClient(asgi.app) as client:
+            response = client.post('/chart-data', content=b'{not json', headers={'Content-Type': 'application/json'})
+            assert response.status_code == 400 and response.json()['error'] == 'No JSON data provided'
+            response = client.post('/chart-data', json={'timeframes': ['1d']})
+            assert response.status_code == 400 and response.json()['error'] == 'Symbol is required'
+
+            # Unreachable, malformed and non-string callback URLs all keep the analysis
+            errors = []
+            for callback_url in (CLOSED_PORT_URL, 'http://[::1', 12345):
+                payload = {'symbol': 'AAPL', 'timeframes': ['1d'], 'callback_url': callback_url}
+                response = client.post('/chart-data', json=payload)
+                assert response.status_code == 207, (callback_url, response.status_code)
+                body = response.json()
+                assert body['message'] == 'Analysis completed but webhook failed'
+                assert '1d' in body['data']['multi_timeframe_analysis']
+                assert app.test_client().post('/chart-data', json=payload).status_code == 207, callback_url
+                errors.append(body['webhook_error'])
+    print(f"✅ 400 on bad input, 207 on webhook failures ({'; '.join(errors)})")
+
+
+if __name__ == "__main__":
+    print("🚀 ASGI App Test (local stub upstream)")
+    print("=" * 50)
+    test_chart_data_parity()
+    test_chart_data_errors()
+    print("\n🎉 Testing completed!")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test script pinning the precision contract of the compact bar container (bars.py).
+Needs no network: bars are synthetic.
+"""
+import numpy as np
+import pandas as pd
+import bars
+from bars import Bars, as_price, FLOAT32_PRICE_LIMIT
+from app import calculate_volume_profile, perform_comprehensive_analysis
+
+
+def random_frame(rows, base, seed):
+    """Random-walk ticker.history()-like frame around `base`, full float64 precision"""
+    rng = np.random.default_rng(seed)
+    close = base * np.exp(np.cumsum(rng.normal(0, 0.005, rows)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, base * 0.003, rows))
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.integers(1_000, 5_000_000, rows).astype(np.float64),
+        'Dividends': 0.0,
+        'Stock Splits': 0.0
+    }, index=pd.date_range('2024-01-01', periods=rows, freq='h', tz='America/New_York'))
+
+
+def frame_bars(frame):
+    """Bars holding the frame's own float64 prices: what the DataFrame path computed on"""
+    reference = Bars.from_frame(frame)
+    return Bars(
+        reference.timestamps, *(frame[column].to_numpy(np.float64) for column in ('Open', 'High', 'Low', 'Close')),
+        reference.volume, reference.tz
+    )
+
+
+def test_as_price_round_trip():
+    """Prices quoted with up to 7 significant digits come back exactly as quoted"""
+    print("🔍 Testing as_price round trip...")
+    rng = np.random.default_rng(1)
+    quoted = [123.45, 0.1234567, 99999.99, 1.5, 0.0001234, 131071.0, 42.0]
+    quoted += [float(f"{value:.7g}") for value in rng.uniform(0.01, FLOAT32_PRICE_LIMIT, 10_000)]
+    for price in quoted:
+        assert as_price(np.float32(price)) == price, price
+        assert as_price(np.float64(price)) == price, price
+    assert isinstance(as_price(np.float32(1.25)), float)
+    print(f"✅ {len(quoted)} quoted prices round-trip through float32")
+
+
+def test_float64_switch():
+    """Series reaching FLOAT32_PRICE_LIMIT are stored as float64, others as float32"""
+    print("\n🔍 Testing the float64 switch...")
+    below = np.array([1.0, FLOAT32_PRICE_LIMIT - 0.01])
+    assert bars.price_dtype(below) == np.float32
+    assert bars.price_dtype(np.array([1.0, FLOAT32_PRICE_LIMIT])) == np.float64
+    assert bars.price_dtype(np.array([np.nan, -FLOAT32_PRICE_LIMIT])) == np.float64
+    assert bars.price_dtype(np.array([np.nan, 5.0])) == np.float32
+    assert bars.price_dtype(np.empty(0)) == np.float32
+
+    frame = random_frame(50, 100.0, seed=2)
+    assert Bars.from_frame(frame).close.dtype == np.float32
+    frame['High'] = frame['High'].where(frame.index != frame.index[10], float(FLOAT32_PRICE_LIMIT))
+    converted = Bars.from_frame(frame)
+    assert all(getattr(converted, field).dtype == np.float64 for field in ('open', 'high', 'low', 'close'))
+    assert np.array_equal(converted.close, frame['Close'].to_numpy())
+    # Just under the limit float32 still holds cents
+    assert abs(as_price(np.float32(FLOAT32_PRICE_LIMIT - 0.01)) - (FLOAT32_PRICE_LIMIT - 0.01)) < 0.005
+    print(f"✅ float32 below {FLOAT32_PRICE_LIMIT}, float64 from there on")
+
+
+def test_bars_match_frame_path():
+    """Analysis on float32 Bars matches the float64 DataFrame values within the contract"""
+    print("\n🔍 Testing Bars output against the DataFrame path...")
+    checked = 0
+    for seed, (rows, base) in enumerate([(500, 100.0), (500, 2.5), (2000, 3000.0), (300, 0.08), (500, 90_000.0), (500, 150_000.0)]):
+        frame = random_frame(rows, base, seed)
+        compact, reference = Bars.from_frame(frame), frame_bars(frame)
+        assert compact.nbytes == rows * (32 if compact.close.dtype == np.float32 else 48)
+
+        profile, expected = calculate_volume_profile(compact), calculate_volume_profile(reference)
+        high, low, volume = (frame[column].to_numpy() for column in ('High', 'Low', 'Volume'))
+        bound = 1 + 2 ** -22 * high.max() * np.sum(volume / (high - low))
+        assert len(profile) == len(expected) == 20
+        for level, reference_level in zip(profile, expected):
+            assert abs(level['volume'] - reference_level['volume']) <= bound, (seed, level, reference_level)
+            for field in ('price_level', 'price_low', 'price_high'):
+                assert abs(level[field] - reference_level[field]) <= 0.01 + 1e-9, (seed, field)
+
+        analysis = perform_comprehensive_analysis(compact, '1h', 'TEST')
+        expected = perform_comprehensive_analysis(reference, '1h', 'TEST')
+        assert abs(analysis['current_price'] - expected['current_price']) <= 0.01
+        assert abs(analysis['price_change_24h'] - expected['price_change_24h']) <= 0.02
+        for candle, reference_candle in zip(analysis['chart_data'], expected['chart_data']):
+            assert candle['date'] == reference_candle['date'] and candle['volume'] == reference_candle['volume']
+            for field in ('open', 'high', 'low', 'close'):
+                assert abs(candle[field] - reference_candle[field]) <= 0.01 + 1e-9, (seed, field)
+        assert abs(analysis['ema_20']['current'] - expected['ema_20']['current']) <= 0.01 + 1e-9
+        checked += rows
+
+        # Bars that switched to float64 reproduce the DataFrame path exactly
+        if compact.close.dtype == np.float64:
+            assert profile == calculate_volume_profile(reference)
+            assert analysis['chart_data'] == expected['chart_data']
+    print(f"✅ {checked} bars within the precision contract")
+
+
+if __name__ == "__main__":
+    print("🚀 Bars Precision Test")
+    print("=" * 50)
+    test_as_price_round_trip()
+    test_float64_switch()
+    test_bars_match_frame_path()
+    print("\n🎉 Testing completed!")
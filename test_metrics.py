@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test script for the stage timing instrumentation (metrics.py).
+Checks the Prometheus exposition format and the ?profile=1 breakdown, against the local upstream stub.
+"""
+import os
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import metrics
+from test_asgi import StubbedUpstream
+
+DETECTOR_STAGES = {
+    'chart_data', 'ema_20', 'volume_profile', 'structure_levels',
+    'order_blocks', 'fair_value_gaps', 'liquidity_zones', 'signals'
+}
+
+
+def sample(text, series):
+    """Value of one series line in Prometheus text output, or None if absent"""
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_prometheus_format():
+    """Histogram buckets are cumulative and cache ratios are derived from the counters"""
+    print("🔍 Testing Prometheus text format...")
+    histogram = metrics.Histogram('smc_test_seconds', 'Test latency', 'stage', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, 'fetch')
+    lines = histogram.render()
+    assert lines[:2] == ['# HELP smc_test_seconds Test latency', '# TYPE smc_test_seconds histogram']
+    assert lines[2:] == [
+        'smc_test_seconds_bucket{stage="fetch",le="0.1"} 1',
+        'smc_test_seconds_bucket{stage="fetch",le="1.0"} 3',
+        'smc_test_seconds_bucket{stage="fetch",le="+Inf"} 4',
+        'smc_test_seconds_sum{stage="fetch"} 4.050000',
+        'smc_test_seconds_count{stage="fetch"} 4'
+    ]
+
+    stats = metrics.CacheStats()
+    for hit in (True, False, True, True):
+        stats.record('result', hit)
+    lines = stats.render()
+    assert 'smc_cache_requests_total{cache="result",result="hit"} 3' in lines
+    assert 'smc_cache_requests_total{cache="result",result="miss"} 1' in lines
+    assert 'smc_cache_hit_ratio{cache="result"} 0.750000' in lines
+
+    text = metrics.render_prometheus()
+    assert text.endswith('\n')
+    for line in text.splitlines():
+        assert line.startswith('# HELP smc_') or line.startswith('# TYPE smc_') or line.startswith('smc_'), line
+    print("✅ Buckets, sums, counts and hit ratio render as expected")
+
+
+def test_chart_data_metrics():
+    """/metrics counts the request and the result cache hit of a repeat request"""
+    from app import app
+
+    print("\n🔍 Testing /metrics after /chart-data requests...")
+    client = app.test_client()
+    before = client.get('/metrics').get_data(as_text=True)
+    with StubbedUpstream(cache_entries=8):
+        for _ in range(2):
+            assert client.post('/chart-data', json={'symbol': 'AAPL', 'timeframes': ['1d']}).status_code == 200
+    response = client.get('/metrics')
+    assert response.headers['Content-Type'] == metrics.PROMETHEUS_CONTENT_TYPE
+    after = response.get_data(as_text=True)
+
+    def delta(series):
+        return (sample(after, series) or 0) - (sample(before, series) or 0)
+
+    assert delta('smc_request_duration_seconds_count{endpoint="chart-data"}') == 2
+    assert delta('smc_cache_requests_total{cache="result",result="miss"}') == 1
+    assert delta('smc_cache_requests_total{cache="result",result="hit"}') == 1
+    assert delta('smc_stage_duration_seconds_count{stage="fetch"}') == 2
+    assert delta('smc_stage_duration_seconds_count{stage="signals"}') == 1  # the hit skipped the analysis
+    assert sample(after, 'smc_cache_hit_ratio{cache="result"}') is not None
+    print("✅ Request, stage and result cache counters moved as expected")
+
+
+def test_profile_breakdown():
+    """?profile=1 returns every pipeline stage, tagged with its timeframe where it has one"""
+    from app import app
+
+    print("\n🔍 Testing ?profile=1 breakdown...")
+    timeframes = ['1d', '1h']
+    with StubbedUpstream(cache_entries=8):
+        response = app.test_client().post('/chart-data?profile=1', json={'symbol': 'AAPL', 'timeframes': timeframes})
+    assert response.status_code == 200
+    assert 'X-Cache' not in response.headers  # profiled requests bypass the cache
+    profile = response.get_json()['profile']
+    stages = profile['stages']
+
+    assert [entry.get('timeframe') for entry in stages if entry['stage'] == 'fetch'] == timeframes
+    for tf in timeframes:
+        expected = DETECTOR_STAGES | {'fetch'} | ({'premium_discount'} if tf in ('1d', '4h') else set())
+        assert {entry['stage'] for entry in stages if entry.get('timeframe') == tf} == expected, tf
+    untagged = {entry['stage'] for entry in stages if 'timeframe' not in entry}
+    assert {'metadata', 'serialization'} <= untagged
+    assert all(entry['ms'] >= 0 for entry in stages)
+    # Upstream calls run concurrently, so each fits in the total but their sum need not
+    assert profile['total_ms'] >= max(entry['ms'] for entry in stages if entry['stage'] in ('fetch', 'metadata'))
+    print(f"✅ {len(stages)} stages in {profile['total_ms']} ms")
+
+
+if __name__ == "__main__":
+    print("🚀 Metrics Test (local stub upstream)")
+    print("=" * 50)
+    test_prometheus_format()
+    test_chart_data_metrics()
+    test_profile_breakdown()
+    print("\n🎉 Testing completed!")
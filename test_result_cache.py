@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for the /chart-data result cache (result_cache.py).
+Covers content negotiation, ETag matching and cache keys, then the 304 and gzip paths against the local upstream stub.
+"""
+import os
+import gzip
+import json
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import result_cache
+from bars import Bars
+from analysis_pool import synthetic_ohlcv
+from test_asgi import StubbedUpstream
+from test_upstream import StubUpstream
+
+PAYLOAD = {'symbol': 'AAPL', 'timeframes': ['1d', '1h'], 'analysis_period': '1mo'}
+
+
+def make_entry(fetched_at='2026-01-01T00:00:00'):
+    data = {'symbol': 'AAPL', 'price': 1.5, 'fetched_at': fetched_at}
+    return result_cache.CacheEntry(data, json.dumps(data).encode('utf-8'))
+
+
+def test_negotiate():
+    """The best accepted precompressed body wins; q=0 and unknown codings are ignored"""
+    print("🔍 Testing Accept-Encoding negotiation...")
+    entry = make_entry()
+    preferred = result_cache.ENCODINGS[0]
+    cases = {
+        None: 'identity',
+        '': 'identity',
+        'br': 'identity',
+        'gzip': 'gzip',
+        'GZIP;q=0.5': 'gzip',
+        'gzip;q=0': 'identity',
+        'gzip;q=bogus': 'identity',
+        'gzip, deflate, br, zstd': preferred,
+        'zstd;q=0, gzip': 'gzip'
+    }
+    for header, expected in cases.items():
+        encoding, body = entry.negotiate(header)
+        assert encoding == expected, (header, encoding)
+        assert body is entry.bodies[expected]
+    assert gzip.decompress(entry.bodies['gzip']) == entry.body
+    print(f"✅ {len(cases)} Accept-Encoding headers negotiated ({', '.join(result_cache.ENCODINGS)} available)")
+
+
+def test_etag_matches():
+    """Tags are weak; If-None-Match matches the tag of any encoding, strong forms and *, but not other digests"""
+    print("\n🔍 Testing ETag matching...")
+    entry = make_entry()
+    assert entry.etag() == f'W/"{entry.digest}"' and entry.etag('gzip') == f'W/"{entry.digest}-gzip"'
+    for header in (entry.etag(), entry.etag('gzip'), f'"{entry.digest}"', f'"other", {entry.etag("zstd")}', '*'):
+        assert entry.matches(header), header
+    for header in (None, '', '"other"', f'"{entry.digest[:-1]}"'):
+        assert not entry.matches(header), header
+
+    # The tag follows the data, not the time it was computed (hence weak: the bytes differ)
+    assert make_entry('2026-06-01T12:00:00').etag() == entry.etag()
+    changed = dict(entry.data, price=1.6)
+    assert result_cache.CacheEntry(changed, json.dumps(changed).encode('utf-8')).etag() != entry.etag()
+    print("✅ ETags match across encodings and fetch times")
+
+
+def test_cache_key():
+    """Keys ignore callback_url and option order, and change with the request or a new bar"""
+    print("\n🔍 Testing cache keys...")
+    bars = Bars.from_frame(synthetic_ohlcv(30))
+    histories = {'1d': bars, '1h': bars}
+    params = {'symbol': 'AAPL', 'timeframes': ['1d', '1h'], 'analysis_period': '1mo', 'callback_url': None}
+    key = result_cache.cache_key(params, histories)
+
+    assert result_cache.cache_key(dict(reversed(list(params.items()))), histories) == key
+    assert result_cache.cache_key(dict(params, callback_url='http://example.com/hook'), histories) == key
+    assert result_cache.cache_key(dict(params, analysis_period='3mo'), histories) != key
+    assert result_cache.cache_key(params, {'1d': bars, '1h': bars.head(29)}) != key
+    assert result_cache.cache_key(params, {'1d': bars, '1h': Bars.empty()}) != key
+    print("✅ Keys follow the analysis options and the last bar of every timeframe")
+
+
+def test_lru_and_ttl():
+    """Least recently used entries are evicted first; expired entries are dropped"""
+    print("\n🔍 Testing eviction and expiry...")
+    cache = result_cache.ResultCache(max_entries=2, ttl=0)
+    for key in ('a', 'b'):
+        cache.put(key, {'key': key}, b'{}')
+    assert cache.get('a') is not None
+    cache.put('c', {'key': 'c'}, b'{}')
+    assert cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+
+    cache = result_cache.ResultCache(max_entries=2, ttl=60)
+    cache.put('a', {'key': 'a'}, b'{}').created -= 61
+    assert cache.get('a') is None
+    assert not result_cache.ResultCache(max_entries=0).enabled
+    print("✅ LRU eviction and TTL expiry")
+
+
+def test_conditional_and_gzip_responses():
+    """Flask and ASGI serve gzip with a per-encoding ETag and answer a matching If-None-Match with 304 without fetching info"""
+    from starlette.testclient import TestClient
+    from app import app
+    import asgi
+
+    print("\n🔍 Testing 304 and gzip responses...")
+    client = app.test_client()
+    with StubbedUpstream(cache_entries=8):
+        response = client.post('/chart-data', json=PAYLOAD, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200 and response.headers['X-Cache'] == 'miss'
+        assert response.headers['Content-Encoding'] == 'gzip' and response.headers['Vary'] == 'Accept-Encoding'
+        etag = response.headers['ETag']
+        assert etag.startswith('W/"') and etag.endswith('-gzip"')
+        data = json.loads(gzip.decompress(response.get_data()))
+        assert data['symbol'] == 'AAPL'
+
+        calls = len(StubUpstream.calls)
+        response = client.post('/chart-data', json=PAYLOAD, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        assert response.status_code == 304 and response.headers['X-Cache'] == 'hit'
+        assert response.get_data() == b'' and 'Content-Encoding' not in response.headers
+        # A hit fetches the histories for its key but not info
+        assert [path for path, _, _ in StubUpstream.calls[calls:]] == ['/history', '/history']
+
+        response = client.post('/chart-data', json=PAYLOAD)
+        assert response.headers['X-Cache'] == 'hit' and 'Content-Encoding' not in response.headers
+        assert response.headers['ETag'] == etag.replace('-gzip', '')
+        assert response.get_json() == data
+
+    # A fresh cache (another worker, or after expiry) recomputes the same data under the same ETag
+    with StubbedUpstream(cache_entries=8) as stub:
+        response = client.post('/chart-data', json=PAYLOAD, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.headers['X-Cache'] == 'miss'
+
+        stub.install()
+        result_cache.results = result_cache.ResultCache(max_entries=8)  # restored by StubbedUpstream
+        with TestClient(asgi.app) as asgi_client:
+            response = asgi_client.post('/chart-data', json=PAYLOAD, headers={'Accept-Encoding': 'gzip'})
+            assert response.status_code == 200 and response.headers['X-Cache'] == 'miss'
+            assert response.headers['ETag'] == etag
+            calls = len(StubUpstream.calls)
+            response = asgi_client.post('/chart-data', json=PAYLOAD, headers={'If-None-Match': etag})
+            assert response.status_code == 304 and response.headers['X-Cache'] == 'hit'
+            assert [path for path, _, _ in StubUpstream.calls[calls:]] == ['/history', '/history']
+    print(f"✅ gzip body, 304 on {etag}, same tag from a fresh cache and from the ASGI app")
+
+
+if __name__ == "__main__":
+    print("🚀 Result Cache Test (local stub upstream)")
+    print("=" * 50)
+    test_negotiate()
+    test_etag_matches()
+    test_cache_key()
+    test_lru_and_ttl()
+    test_conditional_and_gzip_responses()
+    print("\n🎉 Testing completed!")
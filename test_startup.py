@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for lazy loading of the analysis stack (lazy_modules.py) and worker warm-up (app.warm_up).
+Import checks run in a fresh interpreter so modules loaded by other tests do not leak in.
+"""
+import os
+import sys
+import json
+import subprocess
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import metrics
+import lazy_modules
+
+LOADED_CHECK = """
+import sys, json
+def loaded(name):
+    # LazyLoader puts a placeholder in sys.modules; a real import also pulls in submodules
+    return any(module.startswith(name + '.') for module in sys.modules)
+"""
+
+
+def run_fresh(code):
+    """Run code in a new interpreter from this directory; returns what it printed as JSON"""
+    env = dict(os.environ, ANALYSIS_POOL_SIZE='0', ANALYSIS_WARMUP='0', ANALYSIS_POOL_WARMUP='0')
+    result = subprocess.run(
+        [sys.executable, '-c', LOADED_CHECK + code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_light_endpoints_stay_lazy():
+    """Importing the app and serving /health and /symbols does not load pandas, numpy or yfinance"""
+    print("🔍 Testing lazy imports...")
+    state = run_fresh("""
+from app import app
+client = app.test_client()
+statuses = [client.get('/health').status_code, client.get('/symbols').status_code]
+print(json.dumps({'statuses': statuses, 'loaded': {name: loaded(name) for name in ('pandas', 'numpy', 'yfinance')}}))
+""")
+    assert state['statuses'] == [200, 200]
+    assert not any(state['loaded'].values()), state['loaded']
+    print(f"✅ /health and /symbols served with {sorted(state['loaded'])} still unloaded")
+
+
+def test_load_once():
+    """lazy_modules.load() imports the stack the first time and is a no-op afterwards"""
+    print("\n🔍 Testing lazy_modules.load()...")
+    state = run_fresh("""
+import lazy_modules
+np = lazy_modules.lazy_import('numpy')
+before = lazy_modules.is_loaded()
+first, second = lazy_modules.load(), lazy_modules.load()
+print(json.dumps({'before': before, 'first': first, 'second': second, 'after': lazy_modules.is_loaded(),
+                  'numpy': loaded('numpy'), 'works': float(np.arange(4).sum())}))
+""")
+    assert state == {'before': False, 'first': True, 'second': False, 'after': True, 'numpy': True, 'works': 6.0}, state
+    print("✅ load() returned True, then False")
+
+
+def test_warm_up_once_per_process():
+    """warm_up() runs its synthetic analysis once per pid, timed as a startup phase, not as pipeline stages"""
+    import app
+
+    print("\n🔍 Testing warm_up()...")
+    calls = []
+    original = app.perform_comprehensive_analysis, app.ANALYSIS_WARMUP, app._warmed_up_pid
+
+    def counting_analysis(bars, timeframe, symbol):
+        calls.append(symbol)
+        return original[0](bars, timeframe, symbol)
+
+    app.perform_comprehensive_analysis, app.ANALYSIS_WARMUP, app._warmed_up_pid = counting_analysis, True, None
+    try:
+        stages_before = metrics.STAGE_SECONDS.render()
+        app.warm_up()
+        app.warm_up()
+        assert calls == ['WARMUP']
+        # A forked worker has a different pid and warms up again
+        app._warmed_up_pid = -1
+        app.warm_up()
+        assert calls == ['WARMUP', 'WARMUP']
+        assert metrics.STAGE_SECONDS.render() == stages_before
+        warmup = [line for line in metrics.render_prometheus().splitlines() if line.startswith('smc_startup_seconds{phase="warmup"}')]
+        assert len(warmup) == 1 and float(warmup[0].rsplit(' ', 1)[1]) > 0
+    finally:
+        app.perform_comprehensive_analysis, app.ANALYSIS_WARMUP, app._warmed_up_pid = original
+    assert lazy_modules.is_loaded()
+    print(f"✅ Warmed up once per pid: {warmup[0]}")
+
+
+if __name__ == "__main__":
+    print("🚀 Startup Test")
+    print("=" * 50)
+    test_light_endpoints_stay_lazy()
+    test_load_once()
+    test_warm_up_once_per_process()
+    print("\n🎉 Testing completed!")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Test script for the live stream (live_stream.py) against a local replay source.
+Needs no network: bars are synthetic and analysis runs inline.
+"""
+import os
+import json
+import asyncio
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import analysis_pool
+import live_stream
+from app import perform_comprehensive_analysis
+
+
+def replay_source(start=120, step=1):
+    """ReplaySource over synthetic bars for TEST on 1d and 1h"""
+    return live_stream.ReplaySource({
+        ('TEST', '1d'): analysis_pool.synthetic_ohlcv(400),
+        ('TEST', '1h'): analysis_pool.synthetic_ohlcv(400)
+    }, start=start, step=step)
+
+
+def test_shared_feed_fan_out(subscribers=2000, ticks=5):
+    """One feed per symbol, every subscriber gets the same snapshot then deltas"""
+    print(f"🔍 Testing fan-out to {subscribers} subscribers...")
+
+    async def run():
+        hub = live_stream.StreamHub(replay_source(), perform_comprehensive_analysis, poll_interval=3600)
+        subs = [hub.subscribe('TEST', ['1d']) for _ in range(subscribers)]
+        hourly = hub.subscribe('TEST', ['1h'])
+        feed = hub.feeds['TEST']
+        assert len(hub.feeds) == 1 and feed.timeframes() == {'1d', '1h'}
+
+        # The feed's own loop runs the first tick; further ticks are driven by hand
+        while len(feed.states) < 2:
+            await asyncio.sleep(0.01)
+        for _ in range(ticks):
+            await feed.tick()
+
+        events = [subs[0].queue.get_nowait() for _ in range(subs[0].queue.qsize())]
+        assert [event_type for event_type, _ in events] == ['snapshot'] + ['update'] * ticks
+        assert all(sub.queue.qsize() == len(events) for sub in subs[1:])
+        # Every subscriber is handed the same serialized event
+        assert subs[-1].queue.get_nowait()[1] is events[0][1]
+        first_update = json.loads(events[1][1])
+        assert first_update['timeframe'] == '1d' and first_update['candles']
+        print(f"✅ {len(events)} events per subscriber, first update: {sorted(first_update)}")
+
+        hourly_event = json.loads(hourly.queue.get_nowait()[1])
+        assert hourly_event['timeframe'] == '1h'
+
+        for sub in subs + [hourly]:
+            hub.unsubscribe(sub)
+        assert not hub.feeds
+        print("✅ Feed stopped with its last subscriber")
+
+    asyncio.run(run())
+
+
+def test_unwatched_timeframe_resets():
+    """A timeframe whose last subscriber left starts from a fresh snapshot when watched again"""
+    print("\n🔍 Testing state reset for unwatched timeframes...")
+
+    async def run():
+        source = replay_source(start=200, step=10)
+        hub = live_stream.StreamHub(source, perform_comprehensive_analysis, poll_interval=3600)
+        daily = hub.subscribe('TEST', ['1d'])
+        hourly = hub.subscribe('TEST', ['1h'])
+        feed = hub.feeds['TEST']
+        while len(feed.states) < 2:
+            await asyncio.sleep(0.01)
+        stale = json.loads(daily.queue.get_nowait()[1])
+
+        hub.unsubscribe(daily)
+        assert hub.feeds['TEST'] is feed and set(feed.states) == set(feed._signatures) == {'1h'}
+        # The feed keeps polling for the hourly subscriber while nobody watches 1d
+        await feed.tick()
+        assert set(feed.states) == {'1h'}
+
+        again = hub.subscribe('TEST', ['1d'])
+        assert again.queue.empty()  # no stale snapshot on subscribe
+        await feed.tick()
+        event_type, data = again.queue.get_nowait()
+        fresh = json.loads(data)
+        assert event_type == 'snapshot' and fresh['candles'][-1] != stale['candles'][-1]
+
+        hub.unsubscribe(again)
+        hub.unsubscribe(hourly)
+        assert not hub.feeds
+        print(f"✅ Re-subscriber got a fresh snapshot ending {fresh['candles'][-1]['date']}, not {stale['candles'][-1]['date']}")
+
+    asyncio.run(run())
+
+
+class FlakySource:
+    """Wraps a source: timeframes in `failing` raise, timeframes in `slow` take `delay` seconds"""
+
+    def __init__(self, source, failing=(), slow=(), delay=0.5):
+        self.source = source
+        self.failing = set(failing)
+        self.slow = set(slow)
+        self.delay = delay
+
+    async def fetch(self, symbol, timeframe):
+        if timeframe in self.failing:
+            raise ConnectionError(f"{timeframe} unavailable")
+        if timeframe in self.slow:
+            await asyncio.sleep(self.delay)
+        return await self.source.fetch(symbol, timeframe)
+
+
+def test_failed_timeframes_recover():
+    """A failed analysis is retried on the same bars; a failing or slow fetch does not hold up other timeframes"""
+    print("\n🔍 Testing failure isolation between timeframes...")
+    failures = []
+
+    def analyze_failing_once(bars, timeframe, symbol):
+        if timeframe == '1d' and not failures:
+            failures.append(timeframe)
+            return {'error': 'transient failure'}
+        return perform_comprehensive_analysis(bars, timeframe, symbol)
+
+    async def run():
+        # step=0: the bars never change, so only a retry can produce the 1d snapshot
+        source = FlakySource(replay_source(step=0), failing={'1h'})
+        feed = live_stream.SymbolFeed('TEST', source, analyze_failing_once, poll_interval=3600)
+        sub = live_stream.Subscription('TEST', ['1d', '1h'])
+        feed.subscribers.add(sub)
+
+        await feed.tick()
+        assert failures == ['1d'] and not feed.states and not feed._signatures
+        await feed.tick()
+        assert set(feed.states) == {'1d'} and sub.queue.qsize() == 1
+        assert json.loads(sub.queue.get_nowait()[1])['timeframe'] == '1d'
+
+        # A slow timeframe is fetched alongside the others, not after them
+        feed.source = FlakySource(replay_source(step=0), slow={'1h', '1d'}, delay=0.5)
+        started = asyncio.get_running_loop().time()
+        await feed.tick()
+        elapsed = asyncio.get_running_loop().time() - started
+        assert set(feed.states) == {'1d', '1h'} and elapsed < 0.9, elapsed
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    print(f"✅ 1d retried after a failed analysis, 1h failure isolated, two 0.5s fetches in {elapsed:.2f}s")
+
+
+def test_diff_analysis():
+    """Unchanged analysis produces no delta; candles, zones and bias deltas otherwise"""
+    print("\n🔍 Testing analysis deltas...")
+    source = replay_source(start=200, step=10)
+    bars = asyncio.run(source.fetch('TEST', '1d'))
+    analysis = perform_comprehensive_analysis(bars, '1d', 'TEST')
+
+    delta, state = live_stream.diff_analysis(live_stream.empty_state(), analysis)
+    assert len(delta['candles']) == len(analysis['chart_data']) and 'bias' in delta
+    delta, state = live_stream.diff_analysis(state, analysis)
+    assert delta == {}
+
+    newer = perform_comprehensive_analysis(asyncio.run(source.fetch('TEST', '1d')), '1d', 'TEST')
+    delta, state = live_stream.diff_analysis(state, newer)
+    assert len(delta['candles']) == 10
+    print(f"✅ Delta keys after 10 new bars: {sorted(delta)}")
+
+
+def test_slow_subscriber_resync():
+    """A subscriber whose queue overflows is told to resync instead of blocking the feed"""
+    print("\n🔍 Testing slow subscriber resync...")
+
+    async def run():
+        sub = live_stream.Subscription('TEST', ['1d'], queue_size=3)
+        for i in range(5):
+            sub.push('update', str(i))
+        assert await sub.next_event(0) == (live_stream.RESYNC, None)
+        assert await sub.next_event(0.01) is None
+
+    asyncio.run(run())
+    print("✅ Overflowing queue replaced by a resync marker")
+
+
+def test_sse_endpoint():
+    """GET /stream serves the replay feed as Server-Sent Events"""
+    import asgi
+
+    print("\n🔍 Testing /stream endpoint...")
+
+    async def request(query):
+        # Drive the ASGI app directly: test clients buffer the whole (endless) body
+        disconnected = asyncio.Event()
+        requested = []
+        messages = []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if b'event: snapshot' in message.get('body', b''):
+                disconnected.set()
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/stream', 'query_string': query.encode(),
+            'headers': [], 'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80),
+            'root_path': '', 'app': asgi.app
+        }
+        await asyncio.wait_for(asgi.app(scope, receive, send), 30)
+        return messages
+
+    async def run():
+        asgi._stream_hub = live_stream.StreamHub(replay_source(), perform_comprehensive_analysis, poll_interval=3600)
+        messages = await request('')
+        assert messages[0]['status'] == 400
+        messages = await request('symbol=test&timeframes=1d')
+        assert (b'content-type', b'text/event-stream; charset=utf-8') in messages[0]['headers']
+        assert not asgi._stream_hub.feeds
+        return b''.join(message.get('body', b'') for message in messages).decode()
+
+    body = asyncio.run(run())
+    event, data = next(frame for frame in body.split('\n\n') if frame.startswith('event:')).split('\n')
+    data = json.loads(data[len('data: '):])
+    assert event == 'event: snapshot' and data['symbol'] == 'TEST'
+    print(f"✅ SSE snapshot with {len(data['candles'])} candles, feed stopped on disconnect")
+
+
+if __name__ == "__main__":
+    print("🚀 Live Stream Test (replay source)")
+    print("=" * 50)
+    test_shared_feed_fan_out()
+    test_unwatched_timeframe_resets()
+    test_failed_timeframes_recover()
+    test_diff_analysis()
+    test_slow_subscriber_resync()
+    test_sse_endpoint()
+    print("\n🎉 Testing completed!")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test script for the market structure engine (structure.py).
+Needs no network: bars are synthetic.
+"""
+import numpy as np
+import structure
+from bars import Bars
+from app import detect_swing_points, detect_structure_levels
+
+
+def reference_breaks(bars, window, guard=None):
+    """
+    Per-bar restatement of the rules in the structure.py docstring, for checking
+    the vectorized engine. Returns (breaks, per-bar watched levels).
+    """
+    high, low, close = (getattr(bars, field).astype(np.float64) for field in ('high', 'low', 'close'))
+    n = len(bars)
+    confirmed = {}  # bar -> [(side, swing position)] confirmed by it
+    for p in range(window, n - window):
+        if high[p] >= high[p - window:p + window + 1].max():
+            confirmed.setdefault(p + window, []).append(('top', p))
+        if low[p] <= low[p - window:p + window + 1].min():
+            confirmed.setdefault(p + window, []).append(('bottom', p))
+
+    levels = {'top': [np.nan, -1, True], 'bottom': [np.nan, -1, True]}  # price, swing position, crossed
+    watched = {'top': [], 'bottom': []}
+    trend, breaks = structure.NEUTRAL, []
+    for t in range(n):
+        for side, p in confirmed.get(t, []):
+            levels[side] = [high[p] if side == 'top' else low[p], p, False]
+        previous = close[t - 1] if t else np.nan
+        for side, direction in (('top', structure.BULLISH), ('bottom', structure.BEARISH)):
+            price, position, crossed = levels[side]
+            watched[side].append(price)
+            beyond = (lambda value: value > price) if direction == structure.BULLISH else (lambda value: value < price)
+            if crossed or not beyond(close[t]) or beyond(previous):
+                continue
+            if guard is not None and price == guard[side][t]:
+                continue  # the coarser engine reports this one
+            levels[side][2] = True
+            breaks.append((t, direction, 'choch' if trend == -direction else 'bos', position, price))
+            trend = direction
+    return breaks, watched
+
+
+def hand_built(closes):
+    """Bars whose open, high, low and close are all the given closes"""
+    prices = np.asarray(closes, dtype=np.float32)
+    return Bars(
+        timestamps=np.arange(len(prices), dtype=np.int64) * 60 + 1_700_000_000,
+        open=prices, high=prices, low=prices, close=prices, volume=np.ones(len(prices), dtype=np.int64)
+    )
+
+
+def test_hand_built_breaks():
+    """BOS/ChoCH bar indices on a small series, worked out by hand (internal window 2, swing window 4)"""
+    print("🔍 Testing breaks on a hand-built series...")
+    #        0   1   2   3   4   5  6  7   8   9  10  11  12  13  14  15  16  17  18  19  20  21  22  23  24  25 26 27 28 29
+    bars = hand_built([10, 11, 12, 11, 10, 9, 8, 9, 10, 11, 13, 12, 11, 12, 11, 10, 11, 12, 13, 14, 15, 14, 13, 12, 11, 10, 9, 8, 7, 6])
+    market = structure.MarketStructure(internal_window=2, swing_window=4).update(bars)
+    # Internal swing highs 2, 10, 13, 20 and lows 6, 12, 15; swing scale highs 10, 20 and lows 6, 15
+    assert market.internal.breaks == [
+        (10, structure.BULLISH, 'bos', 2, 12.0),     # 13 closes above the high of bar 2, watched since bar 4
+        (15, structure.BEARISH, 'choch', 12, 11.0),  # 10 closes below the low of bar 12, watched since bar 14
+        (18, structure.BULLISH, 'choch', 13, 12.0)   # 12 at bar 17 only touches the high of bar 13
+    ], market.internal.breaks
+    assert market.swing.breaks == [
+        (19, structure.BULLISH, 'bos', 10, 13.0),    # 13 at bar 18 only touches the high of bar 10
+        (26, structure.BEARISH, 'choch', 15, 10.0)
+    ], market.swing.breaks
+    # Bar 26 also breaks the internal low of bar 15, but the swing engine watches that very level
+    unguarded = structure.StructureEngine(2)
+    unguarded.update(bars)
+    assert unguarded.breaks == market.internal.breaks + [(26, structure.BEARISH, 'choch', 15, 10.0)]
+    assert (market.internal.trend, market.swing.trend) == (structure.BULLISH, structure.BEARISH)
+    print("✅ Internal breaks at bars 10, 15, 18; swing breaks at 19, 26; internal break at 26 left to the swing scale")
+
+
+def test_matches_reference(rows=1500, seeds=range(20)):
+    """The vectorized engines give the same breaks as the per-bar reference, guard included"""
+    print("\n🔍 Testing against the per-bar reference...")
+    counts = [0, 0, 0]
+    for seed in seeds:
+        bars = structure._random_walk(rows, seed)
+        for internal_window, swing_window in ((structure.INTERNAL_WINDOW, structure.SWING_WINDOW), (2, 6)):
+            market = structure.MarketStructure(internal_window, swing_window).update(bars)
+            swing_breaks, swing_levels = reference_breaks(bars, swing_window)
+            internal_breaks, _ = reference_breaks(bars, internal_window, guard=swing_levels)
+            assert market.swing.breaks == swing_breaks, (seed, swing_window)
+            assert market.internal.breaks == internal_breaks, (seed, internal_window)
+            counts[0] += len(internal_breaks)
+            counts[1] += len(swing_breaks)
+            counts[2] += len(reference_breaks(bars, internal_window)[0]) - len(internal_breaks)
+    assert counts[2] > 0  # the guard was exercised
+    print(f"✅ {counts[0]} internal and {counts[1]} swing breaks match (the guard left {counts[2]} fewer internal breaks)")
+
+
+def test_incremental_matches_batch(rows=3000, tail=200):
+    """Feeding bars one at a time gives the same breaks and trend as one pass"""
+    print("\n🔍 Testing incremental updates against a single pass...")
+    bars = structure._random_walk(rows)
+    batch = structure.MarketStructure().update(bars)
+
+    incremental = structure.MarketStructure().update(bars.head(rows - tail))
+    for stop in range(rows - tail + 1, rows + 1):
+        incremental.update(bars.head(stop))
+
+    for name in ('internal', 'swing'):
+        one_pass, stepped = getattr(batch, name), getattr(incremental, name)
+        assert stepped.breaks == one_pass.breaks
+        assert stepped.trend == one_pass.trend
+        assert stepped.higher_highs == one_pass.higher_highs and stepped.lower_lows == one_pass.lower_lows
+    print(f"✅ {len(batch.internal.breaks)} internal and {len(batch.swing.breaks)} swing breaks match")
+
+
+def test_structure_levels(rows=2000):
+    """BOS/ChoCH follow the trend; HH/LL keep comparing each swing with the previous one"""
+    print("\n🔍 Testing detect_structure_levels...")
+    bars = structure._random_walk(rows, seed=3)
+    levels = detect_structure_levels(bars)
+
+    highs, lows = detect_swing_points(bars)
+    assert levels['higher_highs'] == [b for a, b in zip(highs, highs[1:]) if b['price'] > a['price']]
+    assert levels['lower_lows'] == [b for a, b in zip(lows, lows[1:]) if b['price'] < a['price']]
+
+    for scale, bos, choch in (('internal', 'internal_bos', 'internal_choch'), ('swing', 'swing_bos', 'change_of_character')):
+        breaks = sorted(levels[bos] + levels[choch], key=lambda item: item['index'])
+        assert breaks, scale
+        for previous, current in zip(breaks, breaks[1:]):
+            # A ChoCH flips the trend, a BOS continues it
+            flipped = previous['type'].split('_')[0] != current['type'].split('_')[0]
+            assert current['type'].endswith('_choch') == flipped
+            assert current['swing_index'] < current['index']
+        assert levels['trend'][scale] == breaks[-1]['type'].split('_')[0]
+        print(f"✅ {scale}: {len(levels[bos])} BOS, {len(levels[choch])} ChoCH, trend {levels['trend'][scale]}")
+
+
+if __name__ == "__main__":
+    print("🚀 Market Structure Test")
+    print("=" * 50)
+    test_hand_built_breaks()
+    test_matches_reference()
+    test_incremental_matches_batch()
+    test_structure_levels()
+    print("\n🎉 Testing completed! Run `python structure.py` for the 1M-bar benchmark.")
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Test script for the upstream scheduler (upstream.py) against a local stub server.
+The stub serves a multi-symbol history endpoint and can answer 429 on demand.
+"""
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+os.environ.setdefault('ANALYSIS_POOL_SIZE', '0')
+
+import requests
+import pandas as pd
+import analysis_pool
+import upstream
+
+
+class StubUpstream(BaseHTTPRequestHandler):
+    """GET /history?symbols=A,B&period=&interval= and /info?symbol=; answers 429 while `throttle` > 0"""
+
+    calls = []
+    throttle = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        StubUpstream.calls.append((url.path, query, time.monotonic()))
+        if StubUpstream.throttle:
+            StubUpstream.throttle -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0.2')
+            self.end_headers()
+            return
+        if url.path == '/history':
+            frame = analysis_pool.synthetic_ohlcv(30)
+            body = {symbol: json.loads(frame.to_json(orient='split', date_unit='s')) for symbol in query['symbols'].split(',')}
+        else:
+            body = {'symbol': query['symbol'], 'longName': f"{query['symbol']} Inc."}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubBackend:
+    """Backend for the stub server; its history endpoint is natively multi-symbol"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def _get(self, path, **params):
+        response = requests.get(f"{self.base_url}{path}", params=params, timeout=5)
+        if response.status_code == 429:
+            raise upstream.Throttled(retry_after=float(response.headers['Retry-After']))
+        response.raise_for_status()
+        return response.json()
+
+    def history(self, symbol, period, interval):
+        return self.bulk_history([symbol], period, interval)[symbol]
+
+    def bulk_history(self, symbols, period, interval):
+        data = self._get('/history', symbols=','.join(symbols), period=period, interval=interval)
+        return {
+            symbol: pd.DataFrame(frame['data'], index=pd.to_datetime(frame['index'], unit='s', utc=True), columns=frame['columns'])
+            for symbol, frame in data.items()
+        }
+
+    def bulk_cost(self, count):
+        return 1
+
+    def info(self, symbol):
+        return self._get('/info', symbol=symbol)
+
+
+class SlowBackend:
+    """In-process backend whose every call takes `delay` seconds; like Yahoo, a bulk call saves nothing"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+
+    def history(self, symbol, period, interval):
+        self.calls.append((symbol, interval))
+        time.sleep(self.delay)
+        return analysis_pool.synthetic_ohlcv(30)
+
+    def bulk_history(self, symbols, period, interval):
+        return {symbol: self.history(symbol, period, interval) for symbol in symbols}
+
+    def bulk_cost(self, count):
+        return count
+
+    def info(self, symbol):
+        self.calls.append((symbol, 'info'))
+        time.sleep(self.delay)
+        return {'symbol': symbol, 'longName': f"{symbol} Inc."}
+
+
+class ScriptedYahoo(upstream.YFinanceBackend):
+    """YFinanceBackend whose per-symbol history calls raise scripted errors instead of going to Yahoo"""
+
+    def __init__(self, failures):
+        self.failures = failures  # symbol -> exceptions raised by its next calls, in order
+        self.calls = []
+
+    def history(self, symbol, period, interval):
+        self.calls.append(symbol)
+        if self.failures.get(symbol):
+            raise self.failures[symbol].pop(0)
+        return analysis_pool.synthetic_ohlcv(30)
+
+    def bulk_cost(self, count):
+        return 1  # price it like a natively bulk backend so the scheduler merges the symbols
+
+
+def start_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubUpstream.calls = []
+    StubUpstream.throttle = 0
+    return server, StubBackend(f"http://127.0.0.1:{server.server_address[1]}")
+
+
+def test_bulk_coalescing():
+    """Pending history requests for different symbols share one bulk call"""
+    print("🔍 Testing bulk coalescing...")
+    server, backend = start_stub()
+    scheduler = upstream.UpstreamScheduler(backend, rate=5, burst=1)
+    try:
+        symbols = [f"SYM{i}" for i in range(10)]
+        futures = [scheduler.submit('history', symbol, '1mo', '1h') for symbol in symbols]
+        futures.append(scheduler.submit('history', 'SYM3', '1mo', '1h'))
+        futures.append(scheduler.submit('history', 'SYM0', '1mo', '1d'))
+        frames = [future.result(10) for future in futures]
+        assert all(len(frame) == 30 for frame in frames)
+
+        history_calls = [query for path, query, _ in StubUpstream.calls if path == '/history']
+        # The first request usually leaves alone on the burst token; the rest wait for the next token together
+        assert len(history_calls) <= 3, history_calls
+        hourly = [symbol for query in history_calls if query['interval'] == '1h' for symbol in query['symbols'].split(',')]
+        assert sorted(hourly) == sorted(symbols)
+        print(f"✅ 12 requests served by {len(history_calls)} upstream calls")
+    finally:
+        scheduler.shutdown()
+        server.shutdown()
+
+
+def test_partial_bulk_failure():
+    """A bulk call keeps the symbols it fetched; only the failed ones fail and only the throttled ones are retried"""
+    print("\n🔍 Testing partial bulk failures...")
+    backend = ScriptedYahoo({'BAD': [ValueError('no such symbol')], 'THR': [upstream.Throttled(retry_after=0.1)]})
+    scheduler = upstream.UpstreamScheduler(backend, rate=0)
+    try:
+        symbols = ['AAA', 'BAD', 'THR', 'BBB', 'CCC']
+        scheduler.bucket.pause(0.2)  # let every request queue up for one bulk call
+        futures = {symbol: scheduler.submit('history', symbol, '1mo', '1h') for symbol in symbols}
+        for symbol in ('AAA', 'THR', 'BBB', 'CCC'):
+            assert len(futures[symbol].result(10)) == 30, symbol
+        try:
+            futures['BAD'].result(10)
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+        # Symbols after the throttled one were not attempted; AAA and BAD were not fetched again
+        assert backend.calls == ['AAA', 'BAD', 'THR', 'THR', 'BBB', 'CCC'], backend.calls
+        print(f"✅ Upstream calls: {backend.calls}")
+    finally:
+        scheduler.shutdown()
+
+
+def test_priority_lanes():
+    """Interactive requests are dispatched ahead of batch requests queued before them"""
+    print("\n🔍 Testing priority lanes...")
+    server, backend = start_stub()
+    scheduler = upstream.UpstreamScheduler(backend, rate=20, burst=1, concurrency=1)
+    try:
+        futures = [scheduler.submit('info', f"BATCH{i}", lane=upstream.BATCH) for i in range(4)]
+        futures.append(scheduler.submit('info', 'LIVE', lane=upstream.INTERACTIVE))
+        for future in futures:
+            future.result(10)
+        order = [query['symbol'] for _, query, _ in StubUpstream.calls]
+        assert order.index('LIVE') <= 1, order
+        print(f"✅ Dispatch order: {order}")
+    finally:
+        scheduler.shutdown()
+        server.shutdown()
+
+    # Prefetch histories sharing the interactive request's (period, interval) must not ride along with it
+    print("\n🔍 Testing priority lanes with prefetch histories in the same group...")
+    backend = SlowBackend(0.05)
+    scheduler = upstream.UpstreamScheduler(backend, rate=2, burst=5)
+    try:
+        prefetch = [scheduler.submit('history', f"PRE{i}", '3mo', '1h', lane=upstream.PREFETCH) for i in range(15)]
+        time.sleep(0.1)  # the burst goes to the first prefetch requests
+        started = time.monotonic()
+        interactive = [
+            scheduler.submit('history', 'AAPL', '3mo', '1h'),
+            scheduler.submit('history', 'AAPL', '3mo', '1d'),
+            scheduler.submit('info', 'AAPL')
+        ]
+        upstream.gather(interactive, timeout=10)
+        elapsed = time.monotonic() - started
+        done = sum(future.done() for future in prefetch)
+        # Three tokens at 2/s; merging 15 prefetch symbols into the 1h call took ~9s
+        assert elapsed < 2.5, elapsed
+        assert done <= 7, done
+        first = [symbol for symbol, _ in backend.calls].index('AAPL')
+        assert first <= 6 and all(symbol == 'AAPL' for symbol, _ in backend.calls[first:first + 3]), backend.calls
+        print(f"✅ Interactive calls done in {elapsed:.2f}s with {done}/15 prefetch histories fetched")
+    finally:
+        scheduler.shutdown()
+
+
+def test_throttle_backoff():
+    """429 responses pause dispatch for Retry-After and the request is retried"""
+    print("\n🔍 Testing backoff on throttling...")
+    server, backend = start_stub()
+    StubUpstream.throttle = 2
+    scheduler = upstream.UpstreamScheduler(backend, rate=0, burst=1)
+    try:
+        assert scheduler.submit('info', 'AAPL').result(10)['longName'] == 'AAPL Inc.'
+        times = [at for _, _, at in StubUpstream.calls]
+        assert len(times) == 3
+        assert all(later - earlier >= 0.2 for earlier, later in zip(times, times[1:]))
+        print(f"✅ Succeeded after 2 throttled attempts, {times[-1] - times[0]:.2f}s of backoff")
+
+        StubUpstream.throttle = 10
+        scheduler.max_retries = 1
+        try:
+            scheduler.submit('info', 'MSFT').result(10)
+            assert False, "expected UpstreamUnavailable"
+        except upstream.UpstreamUnavailable as e:
+            print(f"✅ Gave up after retries: {e} (retry after {e.retry_after}s)")
+    finally:
+        scheduler.shutdown()
+        server.shutdown()
+
+
+def test_request_deadline():
+    """A request's histories run concurrently and share one deadline with info; calls not started by then are cancelled"""
+    from app import app
+
+    print("\n🔍 Testing the per-request deadline...")
+    timeframes = ['1d', '4h', '1h', '15m', '5m']
+    backend = SlowBackend(0.3)
+    scheduler = upstream.UpstreamScheduler(backend, rate=0)
+    original = upstream._scheduler, upstream._scheduler_pid
+    upstream._scheduler, upstream._scheduler_pid = scheduler, os.getpid()
+    try:
+        started = time.monotonic()
+        response = app.test_client().post('/chart-data?profile=1', json={'symbol': 'AAPL', 'timeframes': timeframes})
+        elapsed = time.monotonic() - started
+        assert response.status_code == 200
+        assert len(backend.calls) == len(timeframes) + 1
+        # Six 0.3s calls back to back would take 1.8s; info follows the concurrent histories
+        fetches = [entry for entry in response.get_json()['profile']['stages'] if entry['stage'] in ('fetch', 'metadata')]
+        assert len(fetches) == 6 and max(entry['ms'] for entry in fetches) < 1000, fetches
+        print(f"✅ {len(timeframes)} timeframes fetched concurrently, then info, request took {elapsed:.2f}s")
+    finally:
+        upstream._scheduler, upstream._scheduler_pid = original
+        scheduler.shutdown()
+
+    scheduler = upstream.UpstreamScheduler(backend, rate=0, concurrency=1)
+    backend.calls = []
+    try:
+        futures = [scheduler.submit('history', 'AAPL', '1mo', tf) for tf in timeframes]
+        started = time.monotonic()
+        try:
+            upstream.gather(futures, timeout=0.5)
+            assert False, "expected UpstreamUnavailable"
+        except upstream.UpstreamUnavailable as e:
+            elapsed, error = time.monotonic() - started, str(e)
+        assert elapsed < 0.8, elapsed
+        time.sleep(1)
+        assert len(backend.calls) == 2 and sum(future.cancelled() for future in futures) == 3
+        print(f"✅ Deadline hit after {elapsed:.2f}s ({error}), 3 queued calls cancelled")
+    finally:
+        scheduler.shutdown()
+
+
+def test_chart_data_503():
+    """A throttled upstream turns into 503 with Retry-After instead of a 500"""
+    from app import app
+
+    print("\n🔍 Testing /chart-data when the upstream is throttling...")
+    server, backend = start_stub()
+    StubUpstream.throttle = 100
+    scheduler = upstream.UpstreamScheduler(backend, rate=0, burst=1, max_retries=0)
+    original = upstream._scheduler, upstream._scheduler_pid
+    upstream._scheduler, upstream._scheduler_pid = scheduler, os.getpid()
+    try:
+        response = app.test_client().post('/chart-data', json={'symbol': 'AAPL', 'timeframes': ['1d']})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        print(f"✅ {response.status_code}: {response.get_json()['error']}")
+    finally:
+        upstream._scheduler, upstream._scheduler_pid = original
+        scheduler.shutdown()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    print("🚀 Upstream Scheduler Test (local stub server)")
+    print("=" * 50)
+    test_bulk_coalescing()
+    test_partial_bulk_failure()
+    test_priority_lanes()
+    test_throttle_backoff()
+    test_request_deadline()
+    test_chart_data_503()
+    print("\n🎉 Testing completed!")
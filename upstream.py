@@ -0,0 +1,459 @@
+"""
+Central scheduler for upstream market data calls (Yahoo Finance).
+
+Every ticker.history / ticker.info call goes through one UpstreamScheduler
+per process instead of hitting Yahoo directly, so bursts of traffic queue up
+instead of getting the whole process throttled:
+
+    - A token bucket (UPSTREAM_RATE calls/s, bursts of UPSTREAM_BURST) paces calls.
+    - Requests wait in priority lanes: INTERACTIVE (/chart-data) is always
+      dispatched before PREFETCH (live stream polls), which goes before BATCH.
+    - Identical pending requests share one call and one result. When the
+      backend's bulk_cost() makes a multi-symbol history call cheaper than
+      separate calls, pending history requests with the same period and
+      interval from the dispatched request's lane or a higher one ride along
+      in one bulk call (up to UPSTREAM_BULK_MAX symbols). Lower lanes never
+      join, so they cannot delay an interactive request or spend its tokens.
+      Under load requests pile up waiting for tokens, so they coalesce more.
+    - A throttling response (HTTP 429 / YFRateLimitError) empties the bucket
+      and pauses dispatch with exponential backoff (honoring Retry-After when
+      given); the throttled requests are retried at their original position.
+      A bulk call resolves symbol by symbol: symbols that were fetched are
+      answered, and only the throttled ones are retried (or the failed ones
+      failed).
+      After UPSTREAM_MAX_RETRIES throttles, or UPSTREAM_TIMEOUT seconds of
+      waiting, callers get UpstreamUnavailable, which the API maps to a 503.
+    - A request needing several calls submits them all at once and waits
+      with gather(), so UPSTREAM_TIMEOUT bounds the whole request rather
+      than each call. Keep it well below the gunicorn worker --timeout.
+
+The data source is a backend object with history(), bulk_history(), info()
+and bulk_cost(). bulk_history() maps each symbol to its frame, or to the
+exception fetching it raised; an exception raised by the call itself counts
+for every symbol. test_upstream.py runs the scheduler against a local stub.
+
+Environment:
+    UPSTREAM_RATE           sustained upstream calls per second per process (default: 2, 0 = unlimited)
+    UPSTREAM_BURST          calls allowed back to back after an idle period (default: 5)
+    UPSTREAM_FETCH_THREADS  max upstream calls in flight per process (default: 32)
+    UPSTREAM_BULK_MAX       max symbols merged into one bulk history call (default: 20)
+    UPSTREAM_BACKOFF        first pause after a throttling response, in seconds (default: 2)
+    UPSTREAM_BACKOFF_MAX    longest pause after repeated throttling (default: 60)
+    UPSTREAM_MAX_RETRIES    retries of a throttled request before it fails (default: 3)
+    UPSTREAM_TIMEOUT        seconds a caller waits for its results (default: 60)
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_EXCEPTION, TimeoutError as FutureTimeout, wait
+import metrics
+from lazy_modules import lazy_import
+
+pd = lazy_import('pandas')
+yf = lazy_import('yfinance')
+
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', 2))
+UPSTREAM_BURST = float(os.environ.get('UPSTREAM_BURST', 5))
+UPSTREAM_FETCH_THREADS = int(os.environ.get('UPSTREAM_FETCH_THREADS', 32))
+UPSTREAM_BULK_MAX = int(os.environ.get('UPSTREAM_BULK_MAX', 20))
+UPSTREAM_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', 2))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 60))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 3))
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 60))
+
+# Priority lanes, lowest value dispatched first
+INTERACTIVE, PREFETCH, BATCH = 0, 1, 2
+LANE_NAMES = {INTERACTIVE: 'interactive', PREFETCH: 'prefetch', BATCH: 'batch'}
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream kept throttling us, or the request could not be scheduled in time"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Throttled(Exception):
+    """Raised by backends for a throttling response; retry_after in seconds if the upstream sent one"""
+
+    def __init__(self, message='Too Many Requests', retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttled(error):
+    """True for errors that mean the upstream is rate limiting us"""
+    if isinstance(error, Throttled) or type(error).__name__ == 'YFRateLimitError':
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+
+def retry_after(error):
+    """Seconds the upstream asked us to wait, if it said"""
+    if getattr(error, 'retry_after', None) is not None:
+        return float(error.retry_after)
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class YFinanceBackend:
+    """
+    Yahoo Finance through yfinance. Yahoo's chart endpoint serves one symbol per
+    call (yf.download also makes one call per ticker), so a bulk fetch would
+    only run the symbols back to back and costs one token per symbol: the
+    scheduler never merges symbols for this backend, and each symbol is its
+    own call whose result is delivered as soon as it is fetched.
+    """
+
+    def history(self, symbol, period, interval):
+        return yf.Ticker(symbol).history(period=period, interval=interval)
+
+    def bulk_history(self, symbols, period, interval):
+        results = {}
+        for position, symbol in enumerate(symbols):
+            try:
+                results[symbol] = self.history(symbol, period, interval)
+            except Exception as e:
+                results[symbol] = e
+                if is_throttled(e):
+                    # The rest would be throttled too; they are retried after the backoff
+                    results.update((rest, e) for rest in symbols[position + 1:])
+                    break
+        return results
+
+    def bulk_cost(self, count):
+        return count
+
+    def info(self, symbol):
+        return yf.Ticker(symbol).info
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens/s up to `burst`; a call may overdraw it and repay later"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a call may be dispatched (0 = now)"""
+        if self.rate <= 0:
+            return max(0.0, self.paused_until - self.clock())
+        now = self.clock()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, tokens=1):
+        if self.rate > 0:
+            self._refill(self.clock())
+            self.tokens -= tokens
+
+    def pause(self, seconds):
+        """Stop dispatching for `seconds` and drop saved-up tokens"""
+        now = self.clock()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Request:
+    __slots__ = ('kind', 'symbol', 'period', 'interval', 'lane', 'seq', 'future', 'submitted', 'attempts')
+
+    def __init__(self, kind, symbol, period, interval, lane, seq):
+        self.kind = kind
+        self.symbol = symbol
+        self.period = period
+        self.interval = interval
+        self.lane = lane
+        self.seq = seq
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.lane, self.seq) < (other.lane, other.seq)
+
+    @property
+    def group(self):
+        """Requests in the same group can be answered by one bulk call"""
+        return (self.kind, self.period, self.interval)
+
+
+class UpstreamScheduler:
+    """Paces, prioritizes and coalesces upstream calls; one dispatcher thread plus a worker pool"""
+
+    def __init__(self, backend=None, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST,
+                 concurrency=UPSTREAM_FETCH_THREADS, bulk_max=UPSTREAM_BULK_MAX,
+                 backoff=UPSTREAM_BACKOFF, backoff_max=UPSTREAM_BACKOFF_MAX,
+                 max_retries=UPSTREAM_MAX_RETRIES):
+        self.backend = backend if backend is not None else YFinanceBackend()
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.bulk_max = bulk_max
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+        # Merging distinct symbols only pays when a bulk call costs less than separate calls
+        self.merge_symbols = self.backend.bulk_cost(2) < 2
+        self._pending = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._throttle_streak = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='upstream')
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='upstream-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, kind, symbol, period=None, interval=None, lane=INTERACTIVE):
+        """Queue an upstream call ('history' or 'info'); returns a concurrent.futures.Future"""
+        with self._cond:
+            if self._closed:
+                raise UpstreamUnavailable('Upstream scheduler is shut down')
+            request = _Request(kind, symbol, period, interval, lane, next(self._seq))
+            heapq.heappush(self._pending, request)
+            self._cond.notify()
+        return request.future
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            for request in self._pending:
+                request.future.cancel()
+            self._pending = []
+            self._cond.notify()
+        self._workers.shutdown(wait=False)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                batch = None
+                while batch is None:
+                    if self._closed:
+                        return
+                    wait = None
+                    if self._pending and self._in_flight < self.concurrency:
+                        wait = self.bucket.delay()
+                        if wait == 0:
+                            batch = self._next_batch()
+                            continue
+                    self._cond.wait(wait)
+            if batch:
+                self._workers.submit(self._execute, batch)
+
+    def _next_batch(self):
+        """Pop the highest-priority request plus every pending request that can share its call"""
+        head = heapq.heappop(self._pending)
+        batch = [head]
+        symbols = {head.symbol}
+        merge = head.kind == 'history' and self.merge_symbols
+        remaining = []
+        for request in sorted(self._pending):
+            if request.group != head.group:
+                remaining.append(request)
+            elif request.symbol == head.symbol:
+                # The very same call: sharing it costs nothing, whatever the lane
+                batch.append(request)
+            elif request.symbol in symbols and request.lane <= head.lane:
+                batch.append(request)
+            elif merge and request.lane <= head.lane and len(symbols) < self.bulk_max:
+                symbols.add(request.symbol)
+                batch.append(request)
+            else:
+                remaining.append(request)
+        if len(batch) > 1:
+            self._pending = remaining
+            heapq.heapify(self._pending)
+
+        # Cancelled requests (callers that timed out) never reach the upstream
+        now = time.monotonic()
+        live = []
+        for request in batch:
+            if request.attempts or request.future.set_running_or_notify_cancel():
+                if not request.attempts:
+                    metrics.UPSTREAM_WAIT_SECONDS.observe(now - request.submitted, LANE_NAMES[request.lane])
+                live.append(request)
+        if not live:
+            return []
+
+        symbols = {request.symbol for request in live}
+        self.bucket.take(self.backend.bulk_cost(len(symbols)) if len(symbols) > 1 else 1)
+        self._in_flight += 1
+        return live
+
+    def _execute(self, batch):
+        head = batch[0]
+        symbols = list(dict.fromkeys(request.symbol for request in batch))
+        kind = 'bulk_history' if len(symbols) > 1 else head.kind
+        try:
+            try:
+                if head.kind == 'info':
+                    results = {head.symbol: self.backend.info(head.symbol)}
+                elif len(symbols) > 1:
+                    results = self.backend.bulk_history(symbols, head.period, head.interval)
+                else:
+                    results = {head.symbol: self.backend.history(head.symbol, head.period, head.interval)}
+            except Exception as e:
+                results = dict.fromkeys(symbols, e)
+            self._resolve(batch, kind, results)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+
+    def _resolve(self, batch, kind, results):
+        """Answer each request from its symbol's result; requeue the throttled ones, fail the failed ones"""
+        answered, throttled, throttle_error, failed = [], [], None, False
+        for request in batch:
+            result = results.get(request.symbol)
+            if isinstance(result, Exception) and is_throttled(result):
+                throttled.append(request)
+                throttle_error = result
+            elif isinstance(result, Exception):
+                failed = True
+                request.future.set_exception(result)
+            else:
+                if result is None and request.kind == 'history':
+                    result = pd.DataFrame()
+                answered.append(request)
+                request.future.set_result(result)
+
+        outcome = 'throttled' if throttled else 'error' if failed else 'ok'
+        metrics.record_upstream(kind, outcome, max(len(answered), 1))
+        if throttled:
+            self._throttled(throttled, throttle_error)
+        elif answered:
+            with self._cond:
+                self._throttle_streak = 0
+
+    def _throttled(self, batch, error):
+        """Back off and requeue the batch at its original priority, failing requests out of retries"""
+        with self._cond:
+            pause = retry_after(error)
+            if pause is None:
+                pause = min(self.backoff * 2 ** self._throttle_streak, self.backoff_max)
+            self._throttle_streak += 1
+            self.bucket.pause(pause)
+            logging.error(f"Upstream throttled {len(batch)} request(s), pausing {pause:.1f}s")
+            for request in batch:
+                request.attempts += 1
+                if request.attempts > self.max_retries or self._closed:
+                    request.future.set_exception(UpstreamUnavailable('Upstream rate limit reached', pause))
+                else:
+                    heapq.heappush(self._pending, request)
+            self._cond.notify()
+
+
+_scheduler = None
+_scheduler_pid = None
+_lock = threading.Lock()
+
+
+def get_scheduler():
+    """This process's scheduler, created on first use"""
+    global _scheduler, _scheduler_pid
+    with _lock:
+        # The dispatcher thread does not survive fork (e.g. gunicorn --preload)
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = UpstreamScheduler()
+            _scheduler_pid = os.getpid()
+        return _scheduler
+
+
+def shutdown():
+    global _scheduler
+    with _lock:
+        if _scheduler is not None and _scheduler_pid == os.getpid():
+            _scheduler.shutdown()
+        _scheduler = None
+
+
+def _result(future, timeout):
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise UpstreamUnavailable('Timed out waiting for an upstream slot')
+
+
+async def _result_async(future, timeout):
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise UpstreamUnavailable('Timed out waiting for an upstream slot')
+
+
+def submit(kind, symbol, period=None, interval=None, lane=INTERACTIVE):
+    """Queue a call on this process's scheduler without waiting; collect results with gather()"""
+    return get_scheduler().submit(kind, symbol, period, interval, lane)
+
+
+def _gathered(futures):
+    """Results of futures after a shared deadline: cancel the unfinished, raise the first failure"""
+    for future in futures:
+        future.cancel()  # no-op once running or done
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+    if not all(future.done() and not future.cancelled() for future in futures):
+        raise UpstreamUnavailable('Timed out waiting for an upstream slot')
+    return [future.result() for future in futures]
+
+
+def gather(futures, timeout=UPSTREAM_TIMEOUT):
+    """Wait for several submitted calls against one deadline; stops early on the first failure"""
+    wait(futures, timeout, return_when=FIRST_EXCEPTION)
+    return _gathered(futures)
+
+
+async def gather_async(futures, timeout=UPSTREAM_TIMEOUT):
+    wrapped = [asyncio.wrap_future(future) for future in futures]
+    for future in wrapped:
+        # Failures are raised from the concurrent futures; mark them retrieved here
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    await asyncio.wait(wrapped, timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+    return _gathered(futures)
+
+
+def history(symbol, period, interval, lane=INTERACTIVE, timeout=UPSTREAM_TIMEOUT):
+    """ticker.history(period=period, interval=interval) through the scheduler"""
+    return _result(get_scheduler().submit('history', symbol, period, interval, lane), timeout)
+
+
+def info(symbol, lane=INTERACTIVE, timeout=UPSTREAM_TIMEOUT):
+    """ticker.info through the scheduler"""
+    return _result(get_scheduler().submit('info', symbol, lane=lane), timeout)
+
+
+async def history_async(symbol, period, interval, lane=INTERACTIVE, timeout=UPSTREAM_TIMEOUT):
+    return await _result_async(get_scheduler().submit('history', symbol, period, interval, lane), timeout)
+
+
+async def info_async(symbol, lane=INTERACTIVE, timeout=UPSTREAM_TIMEOUT):
+    return await _result_async(get_scheduler().submit('info', symbol, lane=lane), timeout)